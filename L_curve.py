@@ -50,7 +50,8 @@ def square_gradient(tri, q):
 
 
 # ------------------------------------------------------------------
-def l_curve_point(archive_name, glacier, regularization, partitions):
+def l_curve_point(archive_name, glacier, regularization, partitions,
+                  jobs = 1):
     # Extract the archive of simulation results to a temporary directory
     temp_dir_name = tempfile.mkdtemp()
     tar = tarfile.open(name = archive_name, mode = 'r:gz')
@@ -63,7 +64,7 @@ def l_curve_point(archive_name, glacier, regularization, partitions):
                                         glacier + '/' + glacier + ".2")
     tri = Triangulation(x, y, ele)
     beta = get_field("beta", temp_dir_name + "/elmer/" + glacier + "3d",
-                     partitions, tri, surface = "bottom")
+                     partitions, tri, surface = "bottom", jobs = jobs)
     grad_beta_square = square_gradient(tri, beta)
 
     # Get the value of the total cost function from the Elmer log file
@@ -77,10 +78,11 @@ def l_curve_point(archive_name, glacier, regularization, partitions):
     return cost_function, grad_beta_square
 
 
-# --------------------------------
-def get_l_curve_results(directory, overwrite = False):
+# -------------------------------------------------------------
+def get_l_curve_results(directory, overwrite = False, jobs = 1):
     """
-    Get the errors from the L-curve runs
+    Get the errors from the L-curve runs, reading the partitions of each
+    run's output with `jobs` processes
     """
     costs = []
     tikhs = []
@@ -99,7 +101,7 @@ def get_l_curve_results(directory, overwrite = False):
             start_index = len(glacier) + len("_lambda-")
             regularization = float(archive_name[start_index: -len(extension)])
             cost, tikh = l_curve_point(os.path.join(directory, archive_name),
-                                       glacier, regularization, 4)
+                                       glacier, regularization, 4, jobs)
             costs.append(cost)
             tikhs.append(tikh)
             regs.append(regularization)
@@ -128,9 +130,14 @@ def get_l_curve_results(directory, overwrite = False):
 def analyze(argv):
     """
     This script analyzes the results of the main function and produces
-    the L-curve plot.
+    the L-curve plot. The optional second argument is the number of
+    partitions of the Elmer output to read at once.
     """
-    costs, tikhs, regs = get_l_curve_results(argv[0])
+    jobs = 1
+    if len(argv) > 1:
+        jobs = int(argv[1])
+
+    costs, tikhs, regs = get_l_curve_results(argv[0], jobs = jobs)
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
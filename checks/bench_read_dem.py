@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "../scripts"))
+from read_dem import read_dem
+
+'''
+Time `read_dem` against the line-by-line reader that it replaced, on a
+synthetic .xy file, and check that both give the same grid. Reads are
+timed with the binary cache off, then with it on, both for the first
+read (which writes the cache) and for a repeat read.
+'''
+
+
+# ----------------------------
+def read_dem_by_line(filename):
+    """
+    The original implementation, parsing one line at a time
+    """
+    fid = open(filename, 'r')
+
+    nx = int(fid.readline().split()[0])
+    ny = int(fid.readline().split()[0])
+
+    x = np.zeros(nx)
+    y = np.zeros(ny)
+
+    q = np.zeros((ny, nx))
+
+    for j in range(nx):
+        for i in range(ny):
+            x[j], y[i], q[i,j] = map(float, fid.readline().split())
+
+    return x, y, q
+
+
+# ---------------------------------------
+def write_synthetic_dem(filename, nx, ny):
+    """
+    Write an .xy file on a regular grid with some missing data
+    """
+    x = -200000.0 + 150.0 * np.arange(nx)
+    y = -2300000.0 + 150.0 * np.arange(ny)
+
+    q = 1000.0 * np.sin(x[np.newaxis, :] / 20000.0) \
+               * np.cos(y[:, np.newaxis] / 30000.0)
+    q[::7, ::5] = -2.0e+9
+
+    X, Y = np.meshgrid(x, y)
+    data = np.column_stack((X.T.ravel(), Y.T.ravel(), q.T.ravel()))
+
+    fid = open(filename, 'w')
+    fid.write("{0}\n{1}\n".format(nx, ny))
+    np.savetxt(fid, data, fmt = "%.6f")
+    fid.close()
+
+
+# ---------------------------
+def timed(f, *args, **kwargs):
+    start = time.time()
+    result = f(*args, **kwargs)
+    return time.time() - start, result
+
+
+# ------------
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--size", required = False, default = 1000,
+                        help = "Number of grid points along each side")
+    args, _ = parser.parse_known_args(argv)
+
+    n = int(args.size)
+
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "synthetic.xy")
+        write_synthetic_dem(filename, n, n)
+
+        print("Grid of {0} x {0} points, {1:.1f} MB"
+              .format(n, os.path.getsize(filename) / 1.0e6))
+
+        t, expected = timed(read_dem_by_line, filename)
+        print("Line-by-line reader: {0:8.3f} s".format(t))
+
+        t, result = timed(read_dem, filename, cache = False)
+        print("Bulk reader:         {0:8.3f} s".format(t))
+        same = all(np.array_equal(a, b) for a, b in zip(expected, result))
+
+        t, result = timed(read_dem, filename)
+        print("Writing the cache:   {0:8.3f} s".format(t))
+        same = same and all(np.array_equal(a, b)
+                            for a, b in zip(expected, result))
+
+        t, result = timed(read_dem, filename)
+        print("Reading the cache:   {0:8.3f} s".format(t))
+        same = same and all(np.array_equal(a, b)
+                            for a, b in zip(expected, result))
+    finally:
+        shutil.rmtree(directory)
+
+    if not same:
+        print("The readers disagree!")
+        return 1
+
+    print("All readers agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
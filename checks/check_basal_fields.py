@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "../scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from dems.make_beta import compute_basal_fields, A, rho, g
+
+'''
+Check that the vectorized `compute_basal_fields` agrees with the loops
+over the grid that it replaced, on random grids with missing velocity
+data, ice of zero or negative thickness and points where the SIA velocity
+is faster than the observed velocity. Powers of arrays and of scalars aren't
+always rounded the same way by numpy, and the difference is magnified where
+the SIA velocity nearly cancels the observed velocity, so the results are
+only compared up to a small relative tolerance.
+'''
+
+
+# ---------------------------------------------------
+def compute_basal_fields_loop(x, y, s, b, u, v, frac):
+    """
+    The original implementation, visiting each grid point in turn
+    """
+    nx = len(x)
+    ny = len(y)
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+
+    dsdx = np.zeros((ny, nx))
+    dsdy = np.zeros((ny, nx))
+
+    for i in range(1, ny - 1):
+        for j in range(1, nx - 1):
+            dsdx[i, j] = 0.5 * (s[i, j + 1] - s[i, j - 1]) / dx
+            dsdy[i, j] = 0.5 * (s[i + 1, j] - s[i - 1, j]) / dx
+
+    ds = np.sqrt(dsdx**2 + dsdy**2)
+    avg = np.average(ds)
+    stddev = np.std(ds)
+
+    mva = avg + 0.25 * stddev
+
+    for i in range(ny):
+        for j in range(nx):
+            if ds[i, j] > mva:
+                dsdx[i, j] = mva / ds[i, j] * dsdx[i, j]
+                dsdy[i, j] = mva / ds[i, j] * dsdy[i, j]
+                ds[i, j] = mva
+
+    ub = np.zeros((ny, nx))
+    vb = np.zeros((ny, nx))
+    beta = np.zeros((ny, nx))
+
+    q = 0.0
+    speed = 0.0
+
+    for i in range(1, ny - 1):
+        for j in range(1, nx - 1):
+            if u[i, j] != -2.0e+9:
+                alpha = frac
+                h = max(s[i, j] - b[i, j], 0.0)
+                q = A * (rho * g * h)**3 * ds[i, j]**3 / 2
+                speed = np.sqrt(u[i, j]**2 + v[i, j]**2)
+
+                basal_speed = speed - alpha**3*h*q
+                if basal_speed <= 0.0:
+                    basal_speed = min(10.0, 0.1 * speed)
+                    alpha = ((speed - basal_speed) / (h*q))**(1.0/3)
+
+                ub[i, j] = basal_speed/speed * u[i, j]
+                vb[i, j] = basal_speed/speed * v[i, j]
+
+                beta[i, j] = (2*alpha**3*q / (A*basal_speed**3))**(1.0/6)
+            else:
+                ub[i, j] = -2.0e+9
+                vb[i, j] = -2.0e+9
+                beta[i, j] = -2.0e+9
+
+    def fill_to_boundary(phi):
+        phi[0, :] = phi[1, :]
+        phi[-1, :] = phi[-2, :]
+        phi[:, 0] = phi[:, 1]
+        phi[:, -1] = phi[:, -2]
+
+    fill_to_boundary(beta)
+    fill_to_boundary(ub)
+    fill_to_boundary(vb)
+
+    return beta, ub, vb
+
+
+# ----------------------------
+def random_fields(rng, ny, nx):
+    """
+    Make a grid with a rough glacier surface and bed and a velocity field,
+    some of which is missing
+    """
+    x = 1000.0 * rng.uniform() + 150.0 * np.arange(nx)
+    y = 1000.0 * rng.uniform() + 150.0 * np.arange(ny)
+
+    X, Y = np.meshgrid(x, y)
+    s = 1500.0 - 0.05 * X + 30.0 * rng.standard_normal((ny, nx))
+    b = s - rng.uniform(-100.0, 1200.0, (ny, nx))
+
+    u = rng.uniform(-8000.0, 8000.0, (ny, nx))
+    v = rng.uniform(-8000.0, 8000.0, (ny, nx))
+    u[rng.random_sample((ny, nx)) < 0.2] = -2.0e+9
+
+    # Make the velocity small at some points, so that the guess for the
+    # sliding speed from the SIA is negative
+    slow = rng.random_sample((ny, nx)) < 0.2
+    u[slow & (u != -2.0e+9)] *= 1.0e-4
+    v[slow] *= 1.0e-4
+
+    return x, y, s, b, u, v
+
+
+# ---------------------------
+def compare(expected, result):
+    """
+    Return the largest relative difference between two arrays, or infinity
+    if they have missing data or NaNs in different places
+    """
+    nan = np.isnan(expected)
+    if not np.array_equal(nan, np.isnan(result)):
+        return np.inf
+
+    missing = expected == -2.0e+9
+    if not np.array_equal(missing, result == -2.0e+9):
+        return np.inf
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        diff = np.abs(expected - result) / np.abs(expected)
+    diff[nan | (expected == result)] = 0.0
+
+    return np.max(diff) if diff.size else 0.0
+
+
+# ------------
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--grids", required = False, default = 50,
+                        help = "Number of random grids to check")
+    parser.add_argument("-s", "--seed", required = False, default = 0,
+                        help = "Seed for the random number generator")
+    parser.add_argument("--rtol", required = False, default = 1.0e-10,
+                        help = "Largest relative difference to accept")
+    args, _ = parser.parse_known_args(argv)
+
+    rng = np.random.RandomState(int(args.seed))
+    rtol = float(args.rtol)
+
+    failures = 0
+    worst = 0.0
+    for n in range(int(args.grids)):
+        ny, nx = rng.randint(3, 60), rng.randint(3, 60)
+        frac = rng.uniform(0.1, 1.0)
+        x, y, s, b, u, v = random_fields(rng, ny, nx)
+
+        with np.errstate(all = 'ignore'):
+            expected = compute_basal_fields_loop(x, y, s, b, u, v, frac)
+            result = compute_basal_fields(x, y, s, b, u, v, frac)
+
+        for name, e, r in zip(["beta", "ub", "vb"], expected, result):
+            diff = compare(e, r)
+            worst = max(worst, diff)
+            if diff > rtol:
+                failures += 1
+                print("Grid {0} ({1} x {2}): {3} differs by {4}"
+                      .format(n, ny, nx, name, diff))
+
+    print("Largest relative difference: {0}".format(worst))
+    print("{0} mismatched fields on {1} grids".format(failures, args.grids))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "../scripts"))
+from geodat import fix_weird_points
+
+'''
+Check that the vectorized `fix_weird_points` gives exactly the same output
+as the loop over the grid that it replaced, which modified the grid in
+place as it went, on random rasters with runs and blocks of missing data
+and on long streaks of data surrounded by missing data, which are the worst
+case for the vectorized version since they're eaten away one point at a
+time. Then time both versions on a long streak and on a bigger raster
+with blobs of missing data, like a real velocity mosaic.
+'''
+
+
+# -----------------------------
+def fix_weird_points_loop(data):
+    """
+    The original implementation, visiting each interior point in turn
+    """
+    ny, nx = np.shape(data)
+
+    for i in range(1, ny - 1):
+        for j in range(1, nx - 1):
+            if data[i, j] == -2e+9:
+                nbrs = [ [i+1, i-1, i,   i  ],
+                         [j,   j,   j+1, j-1] ]
+                k = sum( data[nbrs[0], nbrs[1]] != -2e+9 )
+                if k == 4:
+                    data[i,j] = sum( data[nbrs[0],nbrs[1]] )/4.0
+            else:
+                nbrs = [ [i+1, i+1, i+1, i,   i,   i-1, i-1, i-1],
+                         [j+1, j,   j-1, j+1, j-1, j+1, j,   j-1] ]
+                k = sum( data[nbrs[0],nbrs[1]]!=-2e+9 )
+                if k <= 1:
+                    data[i,j] = -2e+9
+
+    for i in range(1, ny - 1):
+        for j in range(1, nx - 1):
+            if data[i,j] != -2e+9:
+                nbrs = [ [i+1, i+1, i+1, i,   i,   i-1, i-1, i-1],
+                         [j+1, j,   j-1, j+1, j-1, j+1, j,   j-1] ]
+                k = sum( data[nbrs[0], nbrs[1]] != -2e+9 )
+                if k < 4:
+                    data[i,j] = -2e+9
+
+    return data
+
+
+# ----------------------------
+def random_raster(rng, ny, nx):
+    """
+    Make a raster with scattered missing points, horizontal and vertical
+    runs of missing data, a few missing blocks and some NaNs
+    """
+    data = rng.standard_normal((ny, nx)) * 100.0
+
+    data[rng.random_sample((ny, nx)) < rng.uniform(0.05, 0.6)] = -2e+9
+
+    for k in range(rng.randint(0, 6)):
+        i, j = rng.randint(0, ny), rng.randint(0, nx)
+        length = rng.randint(1, max(nx, ny))
+        if rng.randint(0, 2):
+            data[i, j: j + length] = -2e+9
+        else:
+            data[i: i + length, j] = -2e+9
+
+    for k in range(rng.randint(0, 3)):
+        i, j = rng.randint(0, ny), rng.randint(0, nx)
+        data[i: i + rng.randint(1, 8), j: j + rng.randint(1, 8)] = -2e+9
+
+    data[rng.random_sample((ny, nx)) < 0.01] = np.nan
+
+    return data
+
+
+# ---------------------------------------------
+def streak_raster(ny, length, vertical = False):
+    """
+    Make a raster with no data except for a single streak of `length`
+    points across the middle of it
+    """
+    data = np.zeros((ny, length + 2)) - 2e+9
+    data[ny // 2, 1: length + 1] = 1.0 + np.arange(length)
+
+    return data.T.copy() if vertical else data
+
+
+# ----------------------------
+def blobby_raster(rng, ny, nx):
+    """
+    Make a raster of smooth data with large blobs of missing data and some
+    scattered missing points
+    """
+    data = rng.standard_normal((ny + 16, nx + 16))
+    for k in range(4):
+        data = 0.25 * (data[2:, 1:-1] + data[:-2, 1:-1]
+                       + data[1:-1, 2:] + data[1:-1, :-2])
+    data = data[:ny, :nx]
+
+    data = np.where(data > 0.0, 100.0 * data, -2e+9)
+    data[rng.random_sample((ny, nx)) < 0.02] = -2e+9
+
+    return data
+
+
+# ---------------
+def compare(data):
+    """
+    Return the number of points where the two versions differ on `data`,
+    along with the time that each one took
+    """
+    start = time.time()
+    expected = fix_weird_points_loop(np.copy(data))
+    loop_time = time.time() - start
+
+    start = time.time()
+    result = fix_weird_points(np.copy(data))
+    vectorized_time = time.time() - start
+
+    same = (expected == result) | (np.isnan(expected) & np.isnan(result))
+
+    return np.sum(~same), loop_time, vectorized_time
+
+
+# ------------
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rasters", required = False, default = 300,
+                        help = "Number of random rasters to check")
+    parser.add_argument("-s", "--seed", required = False, default = 0,
+                        help = "Seed for the random number generator")
+    parser.add_argument("-l", "--length", required = False, default = 2000,
+                        help = "Length of the streak to time")
+    parser.add_argument("--size", required = False, default = 500,
+                        help = "Size of the raster with blobs to time")
+    args, _ = parser.parse_known_args(argv)
+
+    rng = np.random.RandomState(int(args.seed))
+
+    failures = 0
+    for n in range(int(args.rasters)):
+        ny, nx = rng.randint(3, 40), rng.randint(3, 40)
+        differ, _, _ = compare(random_raster(rng, ny, nx))
+        if differ:
+            failures += 1
+            print("Raster {0} ({1} x {2}) differs at {3} points"
+                  .format(n, ny, nx, differ))
+
+    print("{0} of {1} rasters differ".format(failures, args.rasters))
+
+    for length in [1, 2, 3, 10, 100, 300]:
+        for vertical in [False, True]:
+            differ, _, _ = compare(streak_raster(5, length, vertical))
+            if differ:
+                failures += 1
+                print("Streak of length {0} differs at {1} points"
+                      .format(length, differ))
+
+    # Time both versions
+    length = int(args.length)
+    size = int(args.size)
+    for name, data in [("Streak of {0} points".format(length),
+                        streak_raster(200, length)),
+                       ("{0} x {0} raster with blobs".format(size),
+                        blobby_raster(rng, size, size))]:
+        differ, loop_time, vectorized_time = compare(data)
+        print("{0}: loop {1:.3f} s, vectorized {2:.3f} s"
+              .format(name, loop_time, vectorized_time))
+        if differ:
+            failures += 1
+            print("{0} differs at {1} points".format(name, differ))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "../scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from dems.make_beta import smooth_surface
+
+'''
+Check that the vectorized `smooth_surface` gives exactly the same output as
+the loop over the grid that it replaced, which smoothed the surface in place
+as it went and skipped the points with no data, on random rasters with
+scattered points, runs and blocks of missing data. Then time both versions
+on a bigger raster.
+'''
+
+
+# -------------------------
+def smooth_surface_loop(sd):
+    """
+    The original implementation, visiting each interior point in turn
+    """
+    nys, nxs = np.shape(sd)
+
+    for i in range(1, nys - 1):
+        for j in range(1, nxs - 1):
+            if sd[i, j] == -2.0e+9:
+                continue
+
+            total = 4 * sd[i, j]
+            weight = 4
+            for s_nbr in (sd[i + 1, j], sd[i - 1, j],
+                          sd[i, j + 1], sd[i, j - 1]):
+                if s_nbr != -2.0e+9:
+                    total += s_nbr
+                    weight += 1
+
+            sd[i, j] = total / float(weight)
+
+    return sd
+
+
+# ----------------------------
+def random_raster(rng, ny, nx):
+    """
+    Make a rough surface with scattered missing points, runs and blocks of
+    missing data and some NaNs
+    """
+    X, Y = np.meshgrid(np.arange(nx), np.arange(ny))
+    data = 1500.0 - 3.0 * X + 50.0 * rng.standard_normal((ny, nx))
+
+    data[rng.random_sample((ny, nx)) < rng.uniform(0.0, 0.4)] = -2.0e+9
+
+    for k in range(rng.randint(0, 4)):
+        i, j = rng.randint(0, ny), rng.randint(0, nx)
+        length = rng.randint(1, max(nx, ny))
+        if rng.randint(0, 2):
+            data[i, j: j + length] = -2.0e+9
+        else:
+            data[i: i + length, j] = -2.0e+9
+
+    for k in range(rng.randint(0, 3)):
+        i, j = rng.randint(0, ny), rng.randint(0, nx)
+        data[i: i + rng.randint(1, 8), j: j + rng.randint(1, 8)] = -2.0e+9
+
+    data[rng.random_sample((ny, nx)) < 0.01] = np.nan
+
+    return data
+
+
+# ---------------
+def compare(data):
+    """
+    Return the number of points where the two versions differ on `data`,
+    along with the time that each one took
+    """
+    start = time.time()
+    expected = smooth_surface_loop(np.copy(data))
+    loop_time = time.time() - start
+
+    start = time.time()
+    result = smooth_surface(np.copy(data))
+    vectorized_time = time.time() - start
+
+    same = (expected == result) | (np.isnan(expected) & np.isnan(result))
+
+    return np.sum(~same), loop_time, vectorized_time
+
+
+# ------------
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rasters", required = False, default = 300,
+                        help = "Number of random rasters to check")
+    parser.add_argument("-s", "--seed", required = False, default = 0,
+                        help = "Seed for the random number generator")
+    parser.add_argument("--size", required = False, default = 500,
+                        help = "Size of the raster to time")
+    args, _ = parser.parse_known_args(argv)
+
+    rng = np.random.RandomState(int(args.seed))
+
+    failures = 0
+    for n in range(int(args.rasters)):
+        ny, nx = rng.randint(1, 40), rng.randint(1, 40)
+        differ, _, _ = compare(random_raster(rng, ny, nx))
+        if differ:
+            failures += 1
+            print("Raster {0} ({1} x {2}) differs at {3} points"
+                  .format(n, ny, nx, differ))
+
+    print("{0} of {1} rasters differ".format(failures, args.rasters))
+
+    # Time both versions
+    size = int(args.size)
+    differ, loop_time, vectorized_time = \
+        compare(random_raster(rng, size, size))
+    print("{0} x {0} raster: loop {1:.3f} s, vectorized {2:.3f} s"
+          .format(size, loop_time, vectorized_time))
+    if differ:
+        failures += 1
+        print("{0} x {0} raster differs at {1} points".format(size, differ))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,6 +3,7 @@ import sys
 
 import os
 from scripts.read_dem import *
+from scripts.write_dem import write_dem
 
 
 def relabel_external_missing_data(q, i, j):
@@ -70,22 +71,12 @@ def fill_internal_missing_data(q, x, y, d):
 def fixup_data(filename, d, overwrite = True):
     x, y, q = read_dem(filename)
 
-    nx = len(x)
-    ny = len(y)
-
     qc = np.copy(q)
     relabel_external_missing_data(qc, 0, 0)
     fill_internal_missing_data(qc, x, y, d)
     q = np.maximum(qc, q)
 
-    fid = open(filename + ".fixup", 'w')
-    fid.write("{0}\n{1}\n".format(nx, ny))
-
-    for j in range(nx):
-        for i in range(ny):
-            fid.write("{0} {1} {2}\n".format(x[j], y[i], q[i, j]))
-
-    fid.close()
+    write_dem(filename + ".fixup", x, y, q)
 
     if overwrite:
         os.system("mv " + filename + ".fixup " + filename)
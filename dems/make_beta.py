@@ -7,7 +7,8 @@ import argparse
 import math
 import numpy as np
 from scripts.read_dem import *
-from scipy import interpolate
+from scripts.write_dem import write_dem
+from scripts.resample import resample
 
 
 year_in_sec = 365.25 * 24 * 60 * 60
@@ -19,6 +20,9 @@ T = 273 - 13
 R = 8.3144
 A = A0 * math.exp(-Q / (R * T))
 
+glaciers = ["helheim", "kangerd", "jakobshavn"]
+
+
 # ---------------------------------------------------------------------------- #
 def compute_basal_fields(x, y, s, b, u, v, frac):                              #
 # ---------------------------------------------------------------------------- #
@@ -48,10 +52,8 @@ def compute_basal_fields(x, y, s, b, u, v, frac):                              #
     dsdx = np.zeros((ny, nx))
     dsdy = np.zeros((ny, nx))
 
-    for i in range(1, ny - 1):
-        for j in range(1, nx - 1):
-            dsdx[i, j] = 0.5 * (s[i, j + 1] - s[i, j - 1]) / dx
-            dsdy[i, j] = 0.5 * (s[i + 1, j] - s[i - 1, j]) / dx
+    dsdx[1:-1, 1:-1] = 0.5 * (s[1:-1, 2:] - s[1:-1, :-2]) / dx
+    dsdy[1:-1, 1:-1] = 0.5 * (s[2:, 1:-1] - s[:-2, 1:-1]) / dx
 
     # Compute the magnitude of the surface slope, the average slope and the 
     # standard deviation of the slope
@@ -64,12 +66,10 @@ def compute_basal_fields(x, y, s, b, u, v, frac):                              #
     mva = avg + 0.25 * stddev
 
     # Scale the surface slope at any point where it's too steep
-    for i in range(ny):
-        for j in range(nx):
-            if ds[i, j] > mva:
-                dsdx[i, j] = mva / ds[i, j] * dsdx[i, j]
-                dsdy[i, j] = mva / ds[i, j] * dsdy[i, j]
-                ds[i, j] = mva
+    steep = ds > mva
+    dsdx[steep] = mva / ds[steep] * dsdx[steep]
+    dsdy[steep] = mva / ds[steep] * dsdy[steep]
+    ds[steep] = mva
 
 
     #---------------------------------------------------------
@@ -78,40 +78,51 @@ def compute_basal_fields(x, y, s, b, u, v, frac):                              #
     vb = np.zeros((ny, nx))
     beta = np.zeros((ny, nx))
 
-    q = 0.0
-    speed = 0.0
-
-    for i in range(1, ny - 1):
-        for j in range(1, nx - 1):
-            if u[i, j] != -2.0e+9:
-                alpha = frac
-                h = max(s[i, j] - b[i, j], 0.0)
-                q = A * (rho * g * h)**3 * ds[i, j]**3 / 2
-                speed = np.sqrt(u[i, j]**2 + v[i, j]**2)
-
-                basal_speed = speed - alpha**3*h*q
-                if basal_speed <= 0.0:
-                    basal_speed = min(10.0, 0.1 * speed)
-                    alpha = ((speed - basal_speed) / (h*q))**(1.0/3)
-
-                # The basal sliding velocities are assumed to have the same
-                # direction as the surface velocities, only with lower speed
-                # according to a rough SIA-like approximation.
-                ub[i, j] = basal_speed/speed * u[i, j]
-                vb[i, j] = basal_speed/speed * v[i, j]
-
-                # Since we've already guessed the sliding speed and the
-                # x-z strain rate from the SIA, the boundary condition
-                #     tau_xz = -beta**2 * u    (resp. tau_yz, v)
-                # gives us the value of beta consistent with the guesses
-                # we've already made.
-                #TODO handle the case where alpha = 0.0. Should it just be
-                #TODO really really small?
-                beta[i, j] = (2*alpha**3*q / (A*basal_speed**3))**(1.0/6)
-            else:
-                ub[i, j] = -2.0e+9
-                vb[i, j] = -2.0e+9
-                beta[i, j] = -2.0e+9
+    # Work on the interior points with velocity data; all the other
+    # interior points get the no-data value.
+    interior = (slice(1, -1), slice(1, -1))
+    mask = np.zeros((ny, nx), dtype = bool)
+    mask[interior] = u[interior] != -2.0e+9
+
+    ub[interior] = -2.0e+9
+    vb[interior] = -2.0e+9
+    beta[interior] = -2.0e+9
+
+    # The comparisons are written so that NaNs propagate the same way as
+    # with the builtin `max` and `min`
+    h = s[mask] - b[mask]
+    h = np.where(0.0 > h, 0.0, h)
+    q = A * (rho * g * h)**3 * ds[mask]**3 / 2
+    speed = np.sqrt(u[mask]**2 + v[mask]**2)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        alpha = frac * np.ones(len(speed))
+        basal_speed = speed - frac**3*h*q
+
+        # If the SIA velocity is faster than the observed velocity, assume
+        # that some small part of the motion is due to sliding anyway, and
+        # find the fraction of the driving stress consistent with that.
+        slow = basal_speed <= 0.0
+        basal_speed[slow] = np.where(0.1 * speed[slow] < 10.0,
+                                     0.1 * speed[slow], 10.0)
+        alpha[slow] = (((speed[slow] - basal_speed[slow])
+                        / (h[slow]*q[slow]))**(1.0/3))
+
+        # The basal sliding velocities are assumed to have the same
+        # direction as the surface velocities, only with lower speed
+        # according to a rough SIA-like approximation.
+        ub[mask] = basal_speed/speed * u[mask]
+        vb[mask] = basal_speed/speed * v[mask]
+
+        # Since we've already guessed the sliding speed and the
+        # x-z strain rate from the SIA, the boundary condition
+        #     tau_xz = -beta**2 * u    (resp. tau_yz, v)
+        # gives us the value of beta consistent with the guesses
+        # we've already made.
+        #TODO handle the case where alpha = 0.0. Should it just be
+        #TODO really really small?
+        alpha3 = np.where(slow, alpha**3, frac**3)
+        beta[mask] = (2*alpha3*q / (A*basal_speed**3))**(1.0/6)
 
 
     def fill_to_boundary(phi):
@@ -128,7 +139,40 @@ def compute_basal_fields(x, y, s, b, u, v, frac):                              #
 
 
 # ---------------------------------------------------------------------------- #
-def main(argv):                                                                #
+def smooth_surface(s):                                                         #
+# ---------------------------------------------------------------------------- #
+    """
+    Smooth a surface elevation DEM in place, by visiting each interior point
+    in row-major order and replacing it with a weighted average of itself
+    and its four neighbors. Points with no data are left as they are, so
+    that `resample` can still tell where they are, and are left out of the
+    average at the points next to them.
+
+    Each point only depends on the new values of the points above and to
+    the left of it, so all the points on an anti-diagonal i + j = d can be
+    done at once, which gives exactly the same result as a loop.
+    """
+    ny, nx = np.shape(s)
+
+    for d in range(2, ny + nx - 3):
+        i = np.arange(max(1, d - (nx - 2)), min(ny - 2, d - 1) + 1)
+        j = d - i
+
+        centre = s[i, j]
+        total = 4 * centre
+        weight = 4 * np.ones(len(i), dtype = int)
+        for s_nbr in (s[i + 1, j], s[i - 1, j], s[i, j + 1], s[i, j - 1]):
+            has_data = s_nbr != -2.0e+9
+            total = np.where(has_data, total + s_nbr, total)
+            weight += has_data
+
+        s[i, j] = np.where(centre != -2.0e+9, total / weight, centre)
+
+    return s
+
+
+# ---------------------------------------------------------------------------- #
+def main(argv, glaciers = glaciers):                                           #
 # ---------------------------------------------------------------------------- #
     # Parse command line arguments
     frac = 0.5
@@ -140,8 +184,6 @@ def main(argv):                                                                #
     frac = float(args.frac)
 
     # Make the initial guess for basal parameters of each glacier
-    glaciers = ["helheim", "kangerd", "jakobshavn"]
-
     for glacier in glaciers:
         if not (os.path.exists(glacier + "/betaDEM.xy")
             and os.path.exists(glacier + "/UBDEM.xy"  )
@@ -159,61 +201,33 @@ def main(argv):                                                                #
             # Read in the ice surface and bed elevations
             xs, ys, sd = read_dem(glacier + "/zsDEM.xy")
             xb, yb, bd = read_dem(glacier + "/zbDEM.xy")
-            nxs = len(xs)
-            nys = len(ys)
 
 
             #----------------------------------
             # Smooth the ice surface elevation
-            for i in range(1, nys - 1):
-                for j in range(1, nxs - 1):
-                    sd[i, j] = (4 * sd[i, j] +
-                                    sd[i + 1, j] + sd[i - 1, j] +
-                                    sd[i, j + 1] + sd[i, j - 1]) / 8.0
+            smooth_surface(sd)
 
 
             # Interpolate the elevation data to the grid for velocity
-            sf = interpolate.RectBivariateSpline(xs, ys, sd.T)
-            bf = interpolate.RectBivariateSpline(xb, yb, bd.T)
-            s = np.zeros((ny, nx))
-            b = np.zeros((ny, nx))
-
-            for i in range(ny):
-                for j in range(nx):
-                    s[i, j] = sf(x[j], y[i])
-                    b[i, j] = bf(x[j], y[i])
+            s = resample(xs, ys, sd, x, y)
+            b = resample(xb, yb, bd, x, y)
 
-            del sf, bf, xs, ys, sd, xb, yb, bd
+            del xs, ys, sd, xb, yb, bd
 
 
             #----------------------------------------------
             # Compute some bed sliding velocities from SIA
             beta, ub, vb = compute_basal_fields(x, y, s, b, u, v, frac)
 
-            for i in range(ny):
-                for j in range(nx):
-                    if beta[i, j] != -2.0e+9:
-                        beta[i, j] = max(beta[i, j], 0.015)
+            small = (beta != -2.0e+9) & (beta < 0.015)
+            beta[small] = 0.015
 
 
             #---------------------------------
             # Write the results out to a file
-            fidbeta = open(glacier + "/betaDEM.xy", "w")
-            fidub   = open(glacier + "/UBDEM.xy", "w")
-            fidvb   = open(glacier + "/VBDEM.xy", "w")
-            fidbeta.write('{0}\n{1}\n'.format(nx, ny))
-            fidub.write('{0}\n{1}\n'.format(nx, ny))
-            fidvb.write('{0}\n{1}\n'.format(nx, ny))
-
-            for j in range(nx):
-                for i in range(ny):
-                    fidbeta.write("{0} {1} {2}\n".format(x[j], y[i], beta[i, j]))
-                    fidub.write("{0} {1} {2}\n".format(x[j], y[i], ub[i, j]))
-                    fidvb.write("{0} {1} {2}\n".format(x[j], y[i], vb[i, j]))
-
-            fidbeta.close()
-            fidub.close()
-            fidvb.close()
+            write_dem(glacier + "/betaDEM.xy", x, y, beta)
+            write_dem(glacier + "/UBDEM.xy", x, y, ub)
+            write_dem(glacier + "/VBDEM.xy", x, y, vb)
 
             print("Done computing basal fields for " + glacier)
 
@@ -3,16 +3,83 @@
 import sys
 import argparse
 import os
+import time
 import numpy as np
 from netCDF4 import Dataset
 
 from scripts.geodat import *
 from scripts.geotif import *
+from scripts.write_dem import write_dem
 from fixup import fixup_data
 
 
-# ------------
-def main(argv):
+glaciers = ["helheim", "kangerd", "jakobshavn"]
+
+
+# ------------------------------------------
+def read_morlighem_windows(filename, rects):
+    """
+    Extract the bed and surface elevations for several glaciers from
+    Morlighem's mass-conserving dataset for all of Greenland, opening the
+    file and reading the grid coordinates only once.
+
+    Parameters:
+    ==========
+    filename: path to the netCDF file
+    rects:    dictionary mapping each glacier name to the bounding box
+              ((xmin, xmax), (ymin, ymax)) of the window to extract
+
+    Returns:
+    =======
+    windows: dictionary mapping each glacier name to a tuple (x, y, B, S)
+             of the grid coordinates, bed and surface elevations
+    """
+    morlighem_data = Dataset(filename, "r")
+    x = morlighem_data.variables['x'][:]
+    y = morlighem_data.variables['y'][:]
+
+    bed = morlighem_data.variables["bed"]
+    surface = morlighem_data.variables["surface"]
+
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+
+    windows = {}
+    for glacier, r in rects.items():
+        start_time = time.time()
+
+        jmin = int( (r[0][0] - x[0]) / dx )
+        jmax = int( (r[0][1] - x[0]) / dx )
+
+        # Note that this is all weird because Morlighem's dataset goes
+        # from north to south as indices increase
+        imin = int( (r[1][1] - y[0]) / dy )
+        imax = int( (r[1][0] - y[0]) / dy )
+
+        # Read each hyperslab straight into a new array
+        B = np.array(bed[imin:imax, jmin:jmax], dtype = np.float64)
+        S = np.array(surface[imin:imax, jmin:jmax], dtype = np.float64)
+
+        windows[glacier] = (x[jmin:jmax], y[imin:imax][::-1],
+                            B[::-1, :], S[::-1, :])
+
+        print("Extracted bed and surface for {0} in {1:.2f}s"
+              .format(glacier, time.time() - start_time))
+
+    morlighem_data.close()
+
+    return windows
+
+
+# --------------------------------------------------------------------
+def main(argv, glaciers = glaciers, velocity = True, elevation = True):
+    """
+    Make the velocity DEMs and the bed and surface elevation DEMs for each
+    glacier; either part can be turned off with `velocity` or `elevation`.
+    The velocity DEMs for each glacier can be made independently, while the
+    elevations for all of them are best made at once, so that the dataset
+    for all of Greenland only has to be opened once.
+    """
     # Parse command line arguments
     dem_source = "morlighem"
 
@@ -27,14 +94,15 @@ def main(argv):
               "either \"cresis\" or \"morlighem\"\n")
         sys.exit(1)
 
-    glaciers = ["helheim", "kangerd", "jakobshavn"]
-
     # -------------------------
     # Make velocity data files
     for glacier in glaciers:
         if not os.path.exists(glacier):
             os.makedirs(glacier)
 
+        if not velocity:
+            continue
+
         # Check to see if the velocity data have already been made
         if not( os.path.exists(glacier + '/UDEM.xy') or
                 os.path.exists(glacier + '/VDEM.xy')):
@@ -62,19 +130,8 @@ def main(argv):
             ny = imax - imin + 1
 
             # Write out the velocity data
-            fidu = open(glacier + '/UDEM.xy', 'w')
-            fidv = open(glacier + '/VDEM.xy', 'w')
-
-            for fid in [fidu, fidv]:
-                fid.write('{0}\n{1}\n'.format(nx, ny))
-
-            for j in range(nx):
-                for i in range(ny):
-                    fidu.write('{0} {1} {2}\n'.format(x[j], y[i], vx[i,j]))
-                    fidv.write('{0} {1} {2}\n'.format(x[j], y[i], vy[i,j]))
-
-            for fid in [fidu, fidv]:
-                fid.close()
+            write_dem(glacier + '/UDEM.xy', x, y, vx)
+            write_dem(glacier + '/VDEM.xy', x, y, vy)
 
             # Delete the velocities
             del vx, vy
@@ -84,6 +141,8 @@ def main(argv):
 
         print("Done making velocity data for " + glacier)
 
+    if not elevation:
+        return
 
     # ----------------------------------
     # Make surface / bed elevation data
@@ -96,46 +155,16 @@ def main(argv):
              "jakobshavn": ((-209985.0, -135015.0),
                             (-2314985.0, -2245025.0))}
 
+    # If we're using the mass-conserving bed DEM, extract the right window
+    # for each glacier from the big netCDF file for all of Greenland
+    if dem_source == "morlighem":
+        morlighem_windows = read_morlighem_windows(
+            "../data/MCdataset-2015-04-27.nc",
+            dict((glacier, rects[glacier]) for glacier in glaciers))
+
     for glacier in glaciers:
-        # If we're using the mass-conserving bed DEM, extract the right window
-        # for each glacier from the big netCDF file for all of Greenland
         if dem_source == "morlighem":
-            morlighem_data = Dataset("../data/MCdataset-2015-04-27.nc", "r")
-            x = morlighem_data.variables['x'][:]
-            y = morlighem_data.variables['y'][:]
-
-            xmin, xmax = np.min(x), np.max(x)
-            ymin, ymax = np.min(y), np.max(y)
-
-            dx = x[1] - x[0]
-            dy = y[1] - y[0]
-
-            r = rects[glacier]
-
-            jmin = int( (r[0][0] - x[0]) / dx )
-            jmax = int( (r[0][1] - x[0]) / dx )
-
-            # Note that this is all weird because Morlighem's dataset goes
-            # from north to south as indices increase
-            imin = int( (r[1][1] - y[0]) / dy )
-            imax = int( (r[1][0] - y[0]) / dy )
-
-            nx = jmax - jmin
-            ny = imax - imin
-
-            x = x[jmin:jmax]
-            y = y[imin:imax]
-
-            B = np.zeros((ny, nx), dtype = np.float64)
-            S = np.zeros((ny, nx), dtype = np.float64)
-            B[:,:] = morlighem_data.variables["bed"][imin:imax, jmin:jmax]
-            S[:,:] = morlighem_data.variables["surface"][imin:imax, jmin:jmax]
-
-            y = y[::-1]
-            B = B[::-1, :]
-            S = S[::-1, :]
-
-            morlighem_data.close()
+            x, y, B, S = morlighem_windows[glacier]
 
         elif dem_source == "cresis":
             filename = "../data/" + glacier + "/" + glacier
@@ -169,36 +198,24 @@ def main(argv):
         # Write out the surface/bed DEMs
         fields = {"zbDEM.xy": B, "zsDEM.xy": S}
         for filename, field in fields.iteritems():
-            file = open(glacier + '/' + filename, 'w')
-            file.write("{0}\n{1}\n".format(nx, ny))
-            for j in range(nx):
-                for i in range(ny):
-                    if field[i, j] == -9999.0:
-                        field[i, j] = -2.0e+9
-                    file.write("{0} {1} {2}\n"
-                               .format(x[j], y[i], field[i, j]))
+            field[field == -9999.0] = -2.0e+9
+            write_dem(glacier + '/' + filename, x, y, field)
 
 
-    if not os.path.exists("jakobshavn/zsDEM.xy"):
+    if ("jakobshavn" in glaciers and
+        not os.path.exists("jakobshavn/zsDEM.xy")):
         # Make DEMs for Jakobshavn from special data
         if dem_source == "morlighem":
             # read the raw data
             x, y, s = read_geodat("../data/jakobshavn/dem13Mar.smooth")
-            nx = len(x)
-            ny = len(y)
 
             # write out the surface data in the format Elmer expects
-            fid = open("jakobshavn/zsDEM.xy", "w")
-            fid.write("{0}\n{1}\n".format(nx, ny))
-            for j in range(nx):
-                for i in range(ny):
-                    fid.write('{0} {1} {2}\n'.format(x[j], y[i], s[i, j]))
-            fid.close()
+            write_dem("jakobshavn/zsDEM.xy", x, y, s)
         else:
             os.system("wget " + surface_dem_url
                         + "jakobshavn/zsDEM.xy -P jakobshavn")
 
-    print ("Done making surface elevation for Jakobshavn")
+        print ("Done making surface elevation for Jakobshavn")
 
 
 
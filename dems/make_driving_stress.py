@@ -6,10 +6,10 @@ sys.path.insert(0, '../scripts')
 import os
 import math
 import numpy as np
-from scipy import interpolate
 
 from read_dem import *
 from write_qgis import *
+from resample import resample
 
 rho = 917
 g = 9.81
@@ -74,14 +74,9 @@ if __name__ == "__main__":
         (xb, yb, bd) = read_dem(glacier + "/zbDEM.xy")
 
         # Interpolate the bed elevation data to the surface elevation grid
-        bf = interpolate.RectBivariateSpline(xb, yb, bd.T)
-        b = np.zeros((ny, nx))
+        b = resample(xb, yb, bd, x, y)
 
-        for i in range(ny):
-            for j in range(nx):
-                b[i, j] = bf(x[j], y[i])
-
-        del xb, yb, bd, bf
+        del xb, yb, bd
 
         # Make the driving stress field
         tau = driving_stress(x, y, s, b)
@@ -110,7 +110,7 @@ glaciers = ["helheim", "kangerd", "jakobshavn"]
 
 
 # ------------------------------------------------------------------------ #
-def main(argv):                                                            #
+def main(argv, glaciers = glaciers):                                       #
 # ------------------------------------------------------------------------ #
     for glacier in glaciers:
         outfile = glacier + "/ADEM.xy"
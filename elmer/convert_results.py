@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+
+from scripts.elmer import convert_results
+
+
+# ------------
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--elmer", required = True,
+                        help = "Directory of Elmer result files")
+    parser.add_argument("-p", "--partitions", required = True,
+                        help = "Number of mesh partitions")
+    parser.add_argument("-f", "--filename", required = False,
+                        default = "Test_Robin_Beta.result",
+                        help = "Stem of the result files")
+    parser.add_argument("--single", action = "store_true",
+                        help = "Store the values in single precision.")
+
+    args, _ = parser.parse_known_args(argv)
+
+    variables = convert_results(args.elmer, args.filename,
+                                int(args.partitions), single = args.single,
+                                verbose = True)
+
+    print("Converted {0}".format(", ".join(variables)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -4,11 +4,14 @@ import sys
 import argparse
 import os
 
+from scripts.meshes import read_node
+from scripts.elmer import save_mesh_permutation, permutation_filename
+
 glaciers = ["helheim", "kangerd", "jakobshavn"]
 
 
-# ------------
-def main(argv):
+# ---------------------------------
+def main(argv, glaciers = glaciers):
     # Parse command line arguments
     dem_source = "morlighem"
     partitions = 4
@@ -65,6 +68,13 @@ def main(argv):
             os.system("ElmerGrid 2 2 " + glacier
                       + "3d -metis " + str(partitions) + " -removeunused")
 
+        # Match up the columns of the extruded mesh with the nodes of the
+        # Triangle mesh once, rather than every time we post-process
+        if not os.path.exists(glacier + "3d/" + permutation_filename):
+            x, y, _, _ = read_node("../meshes/" + glacier + '/'
+                                   + glacier + ".2.node")
+            save_mesh_permutation(x, y, glacier + "3d")
+
 
 # -----------------------
 if __name__ == "__main__":
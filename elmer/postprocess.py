@@ -16,8 +16,9 @@ from scripts.write_qgis import *
 
 
 
-# ----------------------------------------------------------
-def pp_directory(mesh_file, elmer_dir, partitions, out_file):
+# --------------------------------------------------------------------------
+def pp_directory(mesh_file, elmer_dir, partitions, out_file, binary = False,
+                 jobs = 1):
     """
     Post-process the output from an Elmer inversion into several Arc/Info Grid
     files that can be read by e.g. ArcGIS, QGIS, etc.
@@ -31,6 +32,10 @@ def pp_directory(mesh_file, elmer_dir, partitions, out_file):
                 "Test_Robin_Beta.result.<partition>"
     partitions: number of parallel partitions used for the inversion
     out_file:   desired stem of the output files
+    binary:     if True, write ESRI binary grids (.flt + .hdr) instead of
+                Arc/Info ASCII grids
+    jobs:       number of processes to read the partitions of the Elmer
+                output with
 
     Writes:
     ======
@@ -39,29 +44,26 @@ def pp_directory(mesh_file, elmer_dir, partitions, out_file):
     <out_file>_ub.txt:   computed basal velocities
     <out_file>_us.txt:   computed surface velocities
     <out_file>_uso.txt:  input surface velocities
+    (or <out_file>_taub.flt, <out_file>_taub.hdr, etc. if `binary` is True)
     """
     # Load in the Triangle mesh for the glacier
     xm, ym, ele, bnd = read_triangle_mesh(expanduser(mesh_file))
     tri = Triangulation(xm, ym, ele)
 
-    # Get the basal friction parameter from Elmer
-    beta = get_field("beta", elmer_dir, partitions, tri, surface = "bottom")
-
-    # Get the computed basal velocities
-    uxb = get_field("velocity 1", elmer_dir, partitions, tri, surface = "bottom")
-    uyb = get_field("velocity 2", elmer_dir, partitions, tri, surface = "bottom")
-
-    # Get the computed surface velocities
-    uxs = get_field("velocity 1", elmer_dir, partitions, tri, surface = "top")
-    uys = get_field("velocity 2", elmer_dir, partitions, tri, surface = "top")
-
-    # Get the observed surface velocities
-    uxso = get_field("velod 1", elmer_dir, partitions, tri, surface = "top")
-    uyso = get_field("velod 2", elmer_dir, partitions, tri, surface = "top")
-
-    # Get the computed depth-averaged velocities
-    uxh = get_field("velod 1", elmer_dir, partitions, tri, surface = "average")
-    uyh = get_field("velod 2", elmer_dir, partitions, tri, surface = "average")
+    # Get the basal friction parameter, the computed basal, surface and
+    # depth-averaged velocities and the observed surface velocities from
+    # Elmer, all in one pass over the result files
+    beta, uxb, uyb, uxs, uys, uxso, uyso, uxh, uyh = get_fields(
+        [("beta",       "bottom"),
+         ("velocity 1", "bottom"),
+         ("velocity 2", "bottom"),
+         ("velocity 1", "top"),
+         ("velocity 2", "top"),
+         ("velod 1",    "top"),
+         ("velod 2",    "top"),
+         ("velod 1",    "average"),
+         ("velod 2",    "average")],
+        elmer_dir, partitions, tri, jobs = jobs)
 
     # Interpolate the results to a regularly spaced grid
     xmin = 100.0 * math.floor(np.min(xm)/100.0)
@@ -81,49 +83,39 @@ def pp_directory(mesh_file, elmer_dir, partitions, out_file):
     uh  = -9999.0 * np.ones((ny, nx))
     uso = -9999.0 * np.ones((ny, nx))
 
+    # Interpolate all of the fields with the same sparse operator, which is
+    # only computed the first time the mesh is resampled to this grid.
     # Note: this part needs matplotlib 1.4.2 to work correctly
-    finder = tri.get_trifinder()
-    interp_beta = LinearTriInterpolator(tri, beta, trifinder = finder)
-    interp_uxb = LinearTriInterpolator(tri, uxb,   trifinder = finder)
-    interp_uyb = LinearTriInterpolator(tri, uyb,   trifinder = finder)
-    interp_uxs = LinearTriInterpolator(tri, uxs,   trifinder = finder)
-    interp_uys = LinearTriInterpolator(tri, uys,   trifinder = finder)
-    interp_uxh = LinearTriInterpolator(tri, uxh,   trifinder = finder)
-    interp_uyh = LinearTriInterpolator(tri, uyh,   trifinder = finder)
-    interp_uxso = LinearTriInterpolator(tri, uxso, trifinder = finder)
-    interp_uyso = LinearTriInterpolator(tri, uyso, trifinder = finder)
-
-    for i in range(ny):
-        for j in range(nx):
-            k = int(finder(x[j], y[i]))
-            if k != -1:
-                Beta = interp_beta(x[j], y[i])
-                Uxb  = interp_uxb(x[j], y[i])
-                Uyb  = interp_uyb(x[j], y[i])
-                Uxs  = interp_uxs(x[j], y[i])
-                Uys  = interp_uys(x[j], y[i])
-                Uxh  = interp_uxh(x[j], y[i])
-                Uyh  = interp_uyh(x[j], y[i])
-                Uxso = interp_uxso(x[j], y[i])
-                Uyso = interp_uyso(x[j], y[i])
-
-                ub[i, j] = math.sqrt(Uxb**2 + Uyb**2)
-                us[i, j] = math.sqrt(Uxs**2 + Uys**2)
-                uh[i, j] = math.sqrt(Uxh**2 + Uyh**2)
-                uso[i, j] = math.sqrt(Uxso**2 + Uyso**2)
-                tau[i, j] = 1000 * Beta**2 * ub[i, j]
-
-    # Write the interpolated basal shear stress to the QGIS format
-    write_to_qgis(out_file + "_taub.txt", tau, x[0], y[0], 100.0, -9999)
-    write_to_qgis(out_file + "_us.txt",   us,  x[0], y[0], 100.0, -9999)
-    write_to_qgis(out_file + "_ub.txt",   ub,  x[0], y[0], 100.0, -9999)
-    write_to_qgis(out_file + "_uso.txt",  uso, x[0], y[0], 100.0, -9999)
-    write_to_qgis(out_file + "_uh.txt",   uh,  x[0], y[0], 100.0, -9999)
+    A, inside = grid_interpolation_operator(expanduser(mesh_file), tri, x, y)
 
+    fields = A.dot(np.column_stack((beta, uxb, uyb, uxs, uys, uxh, uyh,
+                                    uxso, uyso)))
+    Beta, Uxb, Uyb, Uxs, Uys, Uxh, Uyh, Uxso, Uyso = [
+        fields[:, k].reshape((ny, nx)) for k in range(9)]
 
+    ub[inside] = np.sqrt(Uxb**2 + Uyb**2)[inside]
+    us[inside] = np.sqrt(Uxs**2 + Uys**2)[inside]
+    uh[inside] = np.sqrt(Uxh**2 + Uyh**2)[inside]
+    uso[inside] = np.sqrt(Uxso**2 + Uyso**2)[inside]
+    tau[inside] = 1000 * Beta[inside]**2 * ub[inside]
 
-# ---------------------------------------------------------
-def pp_archive(archive_name, glacier, partitions, out_file):
+    # Write the interpolated basal shear stress to the QGIS format
+    write_to_qgis(out_file + "_taub.txt", tau, x[0], y[0], 100.0, -9999,
+                  binary = binary)
+    write_to_qgis(out_file + "_us.txt",   us,  x[0], y[0], 100.0, -9999,
+                  binary = binary)
+    write_to_qgis(out_file + "_ub.txt",   ub,  x[0], y[0], 100.0, -9999,
+                  binary = binary)
+    write_to_qgis(out_file + "_uso.txt",  uso, x[0], y[0], 100.0, -9999,
+                  binary = binary)
+    write_to_qgis(out_file + "_uh.txt",   uh,  x[0], y[0], 100.0, -9999,
+                  binary = binary)
+
+
+
+# -------------------------------------------------------------------------
+def pp_archive(archive_name, glacier, partitions, out_file, binary = False,
+               jobs = 1):
     """
     Same thing as pp_directory, only on a .tar archive containing the Elmer
     results as output by the `archive.py` script.
@@ -137,7 +129,8 @@ def pp_archive(archive_name, glacier, partitions, out_file):
     pp_directory(temp_dir_name + "/meshes/" + glacier + '/' + glacier + ".2",
                  temp_dir_name + "/elmer/"  + glacier + "3d",
                  partitions,
-                 temp_dir_name + '/' + glacier)
+                 temp_dir_name + '/' + glacier,
+                 binary = binary, jobs = jobs)
 
     tar = tarfile.open(name = out_file, mode = 'w:gz')
     tar.add(temp_dir_name, arcname = '')
@@ -162,19 +155,27 @@ def main(argv):
     parser.add_argument("-g", "--glacier", required = False,
                         help = "Name of glacier; required if post-processing"
                         " from .tar archive.")
+    parser.add_argument("--binary", action = "store_true",
+                        help = "Write ESRI binary grids (.flt + .hdr) instead"
+                        " of Arc/Info ASCII grids.")
+    parser.add_argument("-j", "--jobs", required = False, default = 1,
+                        help = "Number of partitions to read at once")
 
     args, _ = parser.parse_known_args(argv)
 
     elmer = args.elmer
     out_file = args.output
     partitions = int(args.partitions)
+    jobs = int(args.jobs)
 
     if os.path.isdir(elmer):
         mesh_file = args.mesh
-        pp_directory(mesh_file, elmer, partitions, out_file)
+        pp_directory(mesh_file, elmer, partitions, out_file,
+                     binary = args.binary, jobs = jobs)
     else:
         glacier = args.glacier
-        pp_archive(elmer, glacier, partitions, out_file)
+        pp_archive(elmer, glacier, partitions, out_file,
+                   binary = args.binary, jobs = jobs)
 
 
 if __name__ == "__main__":
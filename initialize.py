@@ -2,15 +2,203 @@
 
 import sys
 import os
+import argparse
+from multiprocessing import Pool
 
 from data import make_data
 from dems import make_dems, make_beta, make_temp
 from meshes import make_meshes
 from elmer import make_elmer_meshes
+from scripts.build import run_task
+
+
+glaciers = ["helheim", "kangerd", "jakobshavn"]
+
+
+# --------------------------------------------
+def elevation_stage(args, glaciers = glaciers):
+    """
+    Return the task which makes the bed and surface elevation DEMs for some
+    glaciers, along with the files that it reads and writes and the
+    parameters it depends on. With Morlighem's DEM this is done for all of
+    the glaciers at once rather than one at a time, so that the dataset for
+    all of Greenland is only opened once.
+    """
+    inputs = []
+    if args.dem == "morlighem":
+        inputs.append("data/MCdataset-2015-04-27.nc")
+
+    outputs = []
+    for glacier in glaciers:
+        data = "data/" + glacier + "/"
+        dems = "dems/" + glacier + "/"
+
+        if args.dem == "morlighem":
+            if glacier == "jakobshavn":
+                inputs += [data + "dem13Mar.smooth",
+                           data + "dem13Mar.smooth.geodat"]
+        else:
+            inputs += [data + glacier + "_composite_bottom.txt",
+                       data + glacier + "_composite_surface.txt"]
+
+        outputs += [dems + "zbDEM.xy", dems + "zsDEM.xy"]
+
+    return {"name": "elevation",
+            "directory": "dems",
+            "stage": make_dems,
+            "options": {"velocity": False},
+            "inputs": inputs,
+            "outputs": outputs,
+            "params": {"dem": args.dem}}
+
+
+# -----------------------
+def stages(glacier, args):
+    """
+    Return the list of preprocessing tasks for one glacier, in the order
+    they have to be run, along with the files that each one reads and
+    writes and the command-line parameters that it depends on. With
+    Morlighem's DEM, the bed and surface elevations are made beforehand for
+    all of the glaciers at once, by the task from `elevation_stage`.
+    """
+    data = "data/" + glacier + "/"
+    dems = "dems/" + glacier + "/"
+    mesh = "meshes/" + glacier + "/" + glacier
+    elmer = "elmer/" + glacier
+
+    velocity = [dems + "UDEM.xy", dems + "VDEM.xy"]
+    elevation = [dems + "zbDEM.xy", dems + "zsDEM.xy"]
+
+    velocity_stage = {
+        "name": "velocity",
+        "directory": "dems",
+        "stage": make_dems,
+        "options": {"elevation": False},
+        "inputs": [data + "mosaicOffsets" + e
+                   for e in [".vx", ".vx.geodat", ".vy", ".vy.geodat"]],
+        "outputs": velocity,
+        "params": {}}
+
+    elevation_stages = []
+    if args.dem != "morlighem":
+        elevation_stages = [elevation_stage(args, [glacier])]
+
+    return [velocity_stage] + elevation_stages + [
+        {"name": "temp",
+         "directory": "dems",
+         "stage": make_temp,
+         "inputs": [dems + "UDEM.xy", data + "xyzTA" + glacier + ".txt"],
+         "outputs": [dems + "ADEM.xy"],
+         "params": {}},
+
+        {"name": "beta",
+         "directory": "dems",
+         "stage": make_beta,
+         "inputs": velocity + elevation,
+         "outputs": [dems + "betaDEM.xy", dems + "UBDEM.xy",
+                     dems + "VBDEM.xy"],
+         "params": {"frac": args.frac}},
+
+        {"name": "meshes",
+         "directory": "meshes",
+         "stage": make_meshes,
+         "inputs": [mesh + ".poly"] + velocity,
+         "outputs": [mesh + ".1.node", mesh + ".1.ele", mesh + ".1.area",
+                     mesh + ".2.node", mesh + ".2.ele"],
+         "clean": [mesh + ".1.*", mesh + ".2.*"],
+         "params": {"length": args.length, "exponent": args.exponent,
+                    "gradation": args.gradation,
+                    "max_nodes": args.max_nodes}},
+
+        {"name": "elmer_meshes",
+         "directory": "elmer",
+         "stage": make_elmer_meshes,
+         "inputs": [mesh + ".2.node", mesh + ".2.ele"] + elevation,
+         "outputs": [elmer + "/mesh.header", elmer + "3d/mesh.header",
+                     elmer + "3d/partitioning.*",
+                     elmer + "3d/mesh_permutation.npz"],
+         # Only remove the mesh files; the 3d directory also holds the
+         # results of any inversions that have been run on the mesh
+         "clean": [elmer + "/mesh.*", elmer + "3d/mesh.*",
+                   elmer + "3d/partitioning.*",
+                   elmer + "3d/mesh_permutation.npz",
+                   dems + "bed.xyz", dems + "surf.xyz"],
+         "params": {"dem": args.dem, "partitions": args.partitions}}
+    ]
+
+
+# ---------------------------------------
+def run_stage(argv, task, glaciers, name):
+    """
+    Run one preprocessing task for some glaciers, unless its inputs and
+    parameters haven't changed since it was last run.
+    """
+    def action():
+        os.chdir(task["directory"])
+        try:
+            task["stage"].main(argv, glaciers, **task.get("options", {}))
+        finally:
+            os.chdir("../")
+
+    run_task(name, action, task["inputs"], task["outputs"], task["params"],
+             clean = task.get("clean"))
+
+
+# ------------------------------
+def setup_glacier(argv, glacier):
+    """
+    Run every stage of the preprocessing for one glacier in order, skipping
+    any stage whose inputs and parameters haven't changed since it was last
+    run.
+    """
+    args = parse_args(argv)
+
+    for task in stages(glacier, args):
+        run_stage(argv, task, [glacier], glacier + "-" + task["name"])
+
+
+# ------------------------
+def _setup_glacier(args):
+    argv, glacier = args
+    setup_glacier(argv, glacier)
+
+
+# ------------------
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", required = False,
+                        help = "Number of glaciers to preprocess at once")
+    parser.add_argument("-d", "--dem", required = True,
+                        help = "DEM source, either 'cresis' or 'morlighem'")
+    parser.add_argument("-f", "--frac", required = False,
+                        help = "Fraction of driving stress to guess basal"
+                               " shear")
+    parser.add_argument("-l", "--length", required = False,
+                        help = "Diameter of the smallest mesh triangles")
+    parser.add_argument("--exponent", required = False,
+                        help = "Power of the speed that the triangle diameter"
+                               " varies as")
+    parser.add_argument("--gradation", required = False,
+                        help = "Maximum rate of growth of the triangle"
+                               " diameter with distance")
+    parser.add_argument("--max-nodes", required = False,
+                        help = "Coarsen the mesh until it has at most this"
+                               " many nodes")
+    parser.add_argument("-p", "--partitions", required = False,
+                        help = "Number of mesh partitions")
+    args, _ = parser.parse_known_args(argv)
+    return args
 
 
 # ------------
 def main(argv):
+    # Parse command line arguments
+    args = parse_args(argv)
+
+    jobs = 1
+    if args.jobs:
+        jobs = int(args.jobs)
+
     if not os.path.exists("lib"):
         os.mkdir("lib")
     os.system("make all")
@@ -19,19 +207,21 @@ def main(argv):
     make_data.main(argv)
     os.chdir("../")
 
-    os.chdir("dems")
-    make_dems.main(argv)
-    make_temp.main(argv)
-    make_beta.main(argv)
-    os.chdir("../")
-
-    os.chdir("meshes")
-    make_meshes.main(argv)
-    os.chdir("../")
+    # Extract the bed and surface elevations for every glacier from
+    # Morlighem's dataset in one go. Other than that the glaciers are
+    # independent of each other, so if we have the cores each one can go
+    # through all of the stages in its own process.
+    if args.dem == "morlighem":
+        run_stage(argv, elevation_stage(args), glaciers, "elevation")
 
-    os.chdir("elmer")
-    make_elmer_meshes.main(argv)
-    os.chdir("../")
+    if jobs > 1:
+        pool = Pool(processes = min(jobs, len(glaciers)), maxtasksperchild = 1)
+        pool.map(_setup_glacier, [(argv, glacier) for glacier in glaciers])
+        pool.close()
+        pool.join()
+    else:
+        for glacier in glaciers:
+            setup_glacier(argv, glacier)
 
 
 # -----------------------
@@ -6,21 +6,96 @@ import os
 
 import numpy as np
 from scripts.meshes import *
+from scripts.read_dem import read_dem
 
 
-# -------------
-def main(argv):
+glaciers = ["helheim", "kangerd", "jakobshavn"]
+
+
+# ----------------------------------------------------------------------
+def refinement_lengths(x, y, ele, v, dx, exponent = 1.0, gradation = 0.3):
+    """
+    Compute the desired diameter of the triangles at each node of a mesh
+    from the ice speed.
+
+    The diameter varies as a power of the speed, equal to `dx` where the ice
+    flows at 1000 m/yr and bounded between `dx` and `4 * dx`. The result is
+    then smoothed so that the diameter grows by at most `gradation` times
+    the distance between any two nodes connected by an edge, which keeps
+    the transition from fine to coarse triangles gradual.
+    """
+    with np.errstate(divide = 'ignore'):
+        lengths = np.clip(dx * (1000.0 / v)**exponent, dx, 4 * dx)
+
+    # Find all the edges of the mesh
+    edges = np.vstack((ele[:, [0, 1]], ele[:, [1, 2]], ele[:, [2, 0]]))
+    edges = np.unique(np.sort(edges, axis = 1), axis = 0)
+    a, b = edges[:, 0], edges[:, 1]
+    d = gradation * np.sqrt((x[a] - x[b])**2 + (y[a] - y[b])**2)
+
+    # Lower the length at each node until it isn't much more than that of
+    # any of its neighbors
+    while True:
+        new_lengths = lengths.copy()
+        np.minimum.at(new_lengths, a, lengths[b] + d)
+        np.minimum.at(new_lengths, b, lengths[a] + d)
+
+        if np.array_equal(new_lengths, lengths):
+            break
+
+        lengths = new_lengths
+
+    return lengths
+
+
+# ----------------------------------
+def write_area(filename, ele, lengths):
+    """
+    Write out a Triangle .area file giving the maximum area of each element
+    of a mesh, from the desired diameter of the triangles at each node
+    """
+    ne = np.shape(ele)[0]
+    area = np.sqrt(3) / 4 * np.mean(lengths[ele], axis = 1)**2
+
+    fid = open(filename, 'w')
+    fid.write('{0}\n'.format(ne))
+    np.savetxt(fid, np.column_stack((np.arange(1, ne + 1), area)),
+               fmt = ['%d', '%.12g'])
+    fid.close()
+
+
+# ---------------------------------
+def main(argv, glaciers = glaciers):
     # Parse command-line arguments
     dx = 250
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--length", required = False,
                         help = "")
+    parser.add_argument("--exponent", required = False,
+                        help = "Power of the speed that the triangle diameter"
+                               " varies as")
+    parser.add_argument("--gradation", required = False,
+                        help = "Maximum rate of growth of the triangle"
+                               " diameter with distance")
+    parser.add_argument("--max-nodes", required = False,
+                        help = "Coarsen the mesh until it has at most this"
+                               " many nodes")
     args, _ = parser.parse_known_args(argv)
     if args.length:
         dx = float(args.length)
 
-    glaciers = ["helheim", "kangerd", "jakobshavn"]
+    exponent = 1.0
+    if args.exponent:
+        exponent = float(args.exponent)
+
+    gradation = 0.3
+    if args.gradation:
+        gradation = float(args.gradation)
+
+    max_nodes = None
+    if args.max_nodes:
+        max_nodes = int(args.max_nodes)
 
     for glacier in glaciers:
         filename = glacier + '/' + glacier
@@ -29,79 +104,60 @@ def main(argv):
         if not os.path.exists(filename + ".1.node"):
             os.system("triangle -pqnea250000.0 " + filename + ".poly")
 
-        # Make a .area file to inform the triangulation of a finer mesh
-        if not os.path.exists(filename + '.1.area'):
-            # Read the velocities
-            fid = open("../dems/" + glacier + "/UDEM.xy")
-            nx = int(fid.readline().split()[0])
-            ny = int(fid.readline().split()[0])
+        if os.path.exists(filename + '.2.node'):
+            continue
 
-            vx = np.zeros((ny, nx))
-            X = np.zeros(nx)
-            Y = np.zeros(ny)
+        # Read the velocities and compute the speed
+        X, Y, vx = read_dem("../dems/" + glacier + "/UDEM.xy")
+        _, _, vy = read_dem("../dems/" + glacier + "/VDEM.xy")
 
-            for j in range(nx):
-                for i in range(ny):
-                    X[j], Y[i], vx[i,j] = map(float, fid.readline().split()[0:])
+        V = np.where(vx != -2e+9, np.sqrt(vx**2 + vy**2), 0.0)
 
-            fid.close()
+        del vx, vy
 
-            fid = open("../dems/" + glacier + "/VDEM.xy")
-            nx = int(fid.readline().split()[0])
-            ny = int(fid.readline().split()[0])
+        # Load in the preliminary mesh
+        x, y, ele, bnd = read_triangle_mesh(filename + ".1")
 
-            vy = np.zeros((ny, nx))
-            for j in range(nx):
-                for i in range(ny):
-                    X[j], Y[i], vy[i,j] = map(float, fid.readline().split()[0:])
-            fid.close()
+        # Find the ice speed at all the mesh points
+        v = gridded_to_point_cloud(x, y, X, Y, V)
 
-            # Compute the speed
-            V = np.zeros((ny, nx))
-            for i in range(ny):
-                for j in range(nx):
-                    if vx[i,j] != -2e+9:
-                        V[i,j] = np.sqrt(vx[i,j]**2 + vy[i,j]**2)
-
-            del vx, vy
-
-            # Load in the preliminary mesh
-            x, y, ele, bnd = read_triangle_mesh(filename + ".1")
-
-            ne = np.shape(ele)[0]
-            nn = len(x)
-
-            # Find the ice speed at all the mesh points
-            v = np.zeros(nn)
-            for n in range(nn):
-                i = int( (y[n] - Y[0]) / 100.0 )
-                j = int( (x[n] - X[0]) / 100.0 )
-                v[n] = 0.25*(V[i,j] + V[i+1,j] + V[i,j+1] + V[i+1,j+1])
-
-            del V, X, Y
-
-            # Output the .area file
-            area = np.zeros(ne)
-            for n in range(ne):
-                speed = sum(v[ele[n,:]])/3
-                if (speed > 1000.0):
-                    area[n] = np.sqrt(3) / 4 * dx**2
-                elif (speed > 500.0):
-                    area[n] = np.sqrt(3) / 4 * (2*dx)**2
-                else:
-                    area[n] = np.sqrt(3) / 4 * (4*dx)**2
-
-            fid = open(filename + ".1.area", 'w')
-            fid.write('{0}\n'.format(ne))
-            for n in range(ne-1):
-                fid.write('{0} {1}\n'.format(n+1, area[n]))
-            fid.write('{0} {1}'.format(ne, area[ne-1]))
-            fid.close()
+        del V, X, Y
+
+        # Make a .area file to inform the triangulation of a finer mesh and
+        # generate the refined mesh. If it has more nodes than we can
+        # afford, scale up all the triangles and try again.
+        scale = 1.0
+        attempts = 10
+        previous = None
+        for k in range(attempts):
+            lengths = refinement_lengths(x, y, ele, v, scale * dx,
+                                         exponent, gradation)
+            write_area(filename + ".1.area", ele, lengths)
 
-        # Generate the refined mesh
-        if not os.path.exists(filename + '.2.node'):
             os.system('triangle -rpqnea ' + filename+'.1')
 
+            fid = open(filename + ".2.node", "r")
+            nn = int(fid.readline().split()[0])
+            fid.close()
+
+            if max_nodes is None or nn <= max_nodes:
+                break
+
+            # Making the triangles bigger only helps up to a point, since
+            # the mesh still has to resolve the boundary, so give up once
+            # it stops getting any smaller.
+            if k == attempts - 1 or (previous is not None and nn >= previous):
+                break
+
+            print("Refined mesh for {0} has {1} nodes, more than the budget "
+                  "of {2}; coarsening".format(glacier, nn, max_nodes))
+            previous = nn
+            scale *= np.sqrt(1.05 * nn / max_nodes)
+
+        if max_nodes is not None and nn > max_nodes:
+            print("Warning: couldn't coarsen the mesh for {0} to within the "
+                  "budget of {1} nodes; keeping the last attempt, with {2} "
+                  "nodes".format(glacier, max_nodes, nn))
 
 # ---------------------------------------------------------------------------- #
 if __name__ == "__main__":                                                     #
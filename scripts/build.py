@@ -0,0 +1,181 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+
+'''
+A small make-like layer over the preprocessing stages. Each task records
+the contents of its input files and the parameters it was run with, and is
+only run again if any of those have changed or if its outputs are missing.
+The same kind of bookkeeping is used by the caches that other modules keep
+next to the files they read, so the helpers for those live here too.
+'''
+
+
+# --------------------
+def file_md5(filename):
+    md5 = hashlib.md5()
+    fid = open(filename, 'rb')
+    chunk = fid.read(1 << 20)
+    while chunk:
+        md5.update(chunk)
+        chunk = fid.read(1 << 20)
+    fid.close()
+    return md5.hexdigest()
+
+
+# ---------------------------
+def file_signature(filenames):
+    """
+    Return the modification time and size of each of the files as one flat
+    list, to check whether something made from them is out of date
+    """
+    signature = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        signature += [stat.st_mtime, stat.st_size]
+
+    return signature
+
+
+# ------------------------------
+def read_cache(filename, read):
+    """
+    Return `read(filename)`, or None if the file is missing or can't be
+    read, so that a cache that isn't there or is broken is just made again
+    """
+    try:
+        return read(filename)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# -----------------------------------
+def write_atomically(filename, write):
+    """
+    Make a file or directory by calling `write` with a temporary name next
+    to it, then move it into place, so that nobody ever sees it partly
+    written; anything already at `filename` is replaced.
+    """
+    temp_filename = filename + ".tmp"
+    if os.path.isdir(temp_filename):
+        shutil.rmtree(temp_filename)
+
+    write(temp_filename)
+
+    if os.path.isdir(filename):
+        shutil.rmtree(filename)
+    os.rename(temp_filename, filename)
+
+
+# ------------------------------
+def write_cache(filename, write):
+    """
+    Same as `write_atomically`, only failures are ignored, since a cache
+    that couldn't be written will just be made again the next time
+    """
+    try:
+        write_atomically(filename, write)
+    except (IOError, OSError):
+        pass
+
+
+# -----------------------------------------
+def input_signatures(inputs, previous = {}):
+    """
+    Compute the signature of each input file, i.e. its modification time,
+    size and md5 hash. Hashing big files is slow, so if the modification
+    time and size of a file are the same as in the `previous` signatures,
+    the hash recorded there is used instead of computing it again.
+    """
+    signatures = {}
+    for filename in inputs:
+        if not os.path.exists(filename):
+            signatures[filename] = None
+            continue
+
+        stat = file_signature([filename])
+
+        old = previous.get(filename)
+        if old is not None and old["stat"] == stat:
+            signatures[filename] = old
+        else:
+            signatures[filename] = {"stat": stat, "md5": file_md5(filename)}
+
+    return signatures
+
+
+# ------------------------
+def remove_outputs(outputs):
+    for pattern in outputs:
+        for filename in glob.glob(pattern):
+            if os.path.isdir(filename):
+                shutil.rmtree(filename)
+            else:
+                os.remove(filename)
+
+
+# --------------------------------------------------------------------
+def run_task(name, action, inputs, outputs, params, clean = None,
+             state_dir = ".build"):
+    """
+    Run a task, unless it has been run before with the same inputs and
+    parameters and all of its outputs are still there.
+
+    Parameters:
+    ==========
+    name:      unique name for the task, e.g. "helheim-beta"
+    action:    function of no arguments which makes the outputs
+    inputs:    list of paths to the files that the task reads
+    outputs:   list of paths or glob patterns for the files it makes
+    params:    dictionary of the parameters that the task depends on
+    clean:     list of paths or glob patterns to delete before rerunning the
+               task, since the stages skip any outputs that already exist;
+               defaults to `outputs`
+    state_dir: directory to keep the record of each task in
+
+    Returns:
+    =======
+    True if the task was run, False if it was up to date
+    """
+    if clean is None:
+        clean = outputs
+
+    def read_stamp(filename):
+        with open(filename, 'r') as fid:
+            return json.load(fid)
+
+    stamp_filename = os.path.join(state_dir, name + ".json")
+    stamp = read_cache(stamp_filename, read_stamp) or {}
+
+    previous = stamp.get("inputs", {})
+    signatures = input_signatures(inputs, previous)
+
+    def digests(signatures):
+        return dict((filename, signature and signature["md5"])
+                    for filename, signature in signatures.items())
+
+    up_to_date = (stamp.get("params") == params and
+                  set(previous.keys()) == set(signatures.keys()) and
+                  digests(previous) == digests(signatures) and
+                  all(glob.glob(pattern) for pattern in outputs))
+
+    if not up_to_date:
+        remove_outputs(clean)
+        action()
+
+    if not os.path.exists(state_dir):
+        try:
+            os.makedirs(state_dir)
+        except OSError:
+            pass
+
+    def write_stamp(filename):
+        with open(filename, 'w') as fid:
+            json.dump({"params": params, "inputs": signatures}, fid,
+                      indent = 2)
+
+    write_atomically(stamp_filename, write_stamp)
+
+    return not up_to_date
@@ -2,9 +2,16 @@
 import numpy as np
 from os.path import expanduser, normpath
 import os
+import re
+import json
+import mmap
+import itertools
+from multiprocessing import Pool
 
 from scipy.spatial import cKDTree
 
+from build import file_signature, read_cache, write_cache, write_atomically
+
 
 # -------------------------------
 def get_error_from_elmer_log(log):
@@ -17,28 +24,54 @@ def get_error_from_elmer_log(log):
     return err
 
 
-# --------------------
-def bufcount(filename):
-    """
-    Count how many reads we have to do through one of Elmer's big files
-    """
-    f = open(filename)
-    lines = 0
-    buf_size = 1024 * 1024
-    read_f = f.read # loop optimization
-    buf = read_f(buf_size)
-    while buf:
-        lines += buf.count('\n')
-        buf = read_f(buf_size)
-    return lines
+# Name of the file in an Elmer mesh directory where the permutation from the
+# columns of the extruded mesh to the nodes of the 2D mesh is kept
+permutation_filename = "mesh_permutation.npz"
 
 
-# -------------------------------------------
-def reconcile_elmer_with_mesh(xt, yt, xe, ye):
+# ---------------------------------------------
+def _read_permutation(filename, xt, yt, xe, ye):
+    def read(filename):
+        saved = np.load(filename)
+        try:
+            if all(np.array_equal(saved[name], value) for name, value in
+                   [("xt", xt), ("yt", yt), ("xe", xe), ("ye", ye)]):
+                return saved["permutation"]
+            return None
+        finally:
+            saved.close()
+
+    return read_cache(filename, read)
+
+
+# -----------------------------------------------------------
+def _write_permutation(filename, xt, yt, xe, ye, permutation):
+    def write(filename):
+        with open(filename, 'wb') as fid:
+            np.savez(fid, xt = xt, yt = yt, xe = xe, ye = ye,
+                     permutation = permutation)
+
+    write_cache(filename, write)
+
+
+# ------------------------------------------------------------
+def reconcile_elmer_with_mesh(xt, yt, xe, ye, filename = None):
     """
     Find a permutation which will map the ordering of the unknowns in the
     Elmer mesh to the original mesh as generated by Triangle
+
+    If `filename` is given, the permutation is saved there along with the
+    coordinates it was computed from, and read back instead of computed
+    again as long as the coordinates are the same.
     """
+    xt, yt = np.asarray(xt), np.asarray(yt)
+    xe, ye = np.asarray(xe), np.asarray(ye)
+
+    if filename is not None:
+        p = _read_permutation(filename, xt, yt, xe, ye)
+        if p is not None:
+            return p
+
     nn = len(xt)
     p = np.zeros(nn, dtype = int)
 
@@ -54,9 +87,471 @@ def reconcile_elmer_with_mesh(xt, yt, xe, ye):
 
     _, p = tree.query(Xt)
 
+    if filename is not None:
+        _write_permutation(filename, xt, yt, xe, ye, p)
+
     return p
 
 
+# ----------------------
+def read_nodes(filename):
+    """
+    Read in one of the .nodes files of a partitioned Elmer mesh, in which
+    each line consists of the node number, a partition tag and the x, y, z
+    coordinates of the node.
+
+    Returns:
+    =======
+    node:    the number of each node
+    x, y, z: the coordinates of each node
+    """
+    fid = open(filename, "r")
+    table = np.fromstring(fid.read(), sep = ' ')
+    fid.close()
+
+    if len(table) % 5 != 0:
+        raise ValueError("Expected 5 fields on each line of {0}"
+                         .format(filename))
+
+    table = table.reshape((-1, 5))
+
+    return (table[:, 0].astype(int),
+            np.copy(table[:, 2]), np.copy(table[:, 3]), np.copy(table[:, 4]))
+
+
+# -----------------------
+def _numeric_line(line):
+    try:
+        float(line)
+    except ValueError:
+        return False
+    return True
+
+
+# -------------------------------------------
+def index_result_file(filename, cache = True):
+    """
+    Make an index of all the lines in an Elmer result file that aren't just
+    numbers, i.e. the header, the time step markers and the names of the
+    variables that start each block of values. The file is scanned in one go
+    without reading it line by line.
+
+    If `cache` is True, the index is saved next to the result file, i.e. in
+    "filename.index", and read from there instead of scanning the file again
+    as long as the result file hasn't been modified since.
+
+    Returns:
+    =======
+    index: a list of tuples (line, offset, timestep) for each such line,
+           where `offset` is the position in the file just after the line
+           and `timestep` is the number of "Time:" lines up to and including
+           it, i.e. 0 for the header
+    """
+    def read(index_filename):
+        with open(index_filename, "r") as fid:
+            saved = json.load(fid)
+        if saved["signature"] != file_signature([filename]):
+            return None
+        return [tuple(entry) for entry in saved["index"]]
+
+    if cache:
+        index = read_cache(filename + ".index", read)
+        if index is not None:
+            return index
+
+    index = []
+    timestep = 0
+
+    fid = open(filename, "rb")
+    if os.fstat(fid.fileno()).st_size == 0:
+        fid.close()
+        return index
+
+    buf = mmap.mmap(fid.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        # Searching for a newline followed by a letter is much faster than
+        # matching at the start of every line, so check the first line on
+        # its own
+        matches = itertools.chain(
+            [re.match(br'[ \t]*[A-Za-z][^\n]*', buf)],
+            re.finditer(br'\n[ \t]*[A-Za-z][^\n]*', buf))
+
+        for match in matches:
+            if match is None:
+                continue
+
+            line = match.group().strip().decode('ascii', 'replace')
+
+            # The values in each block can be NaN or Infinity, which start
+            # with a letter but aren't names
+            if line.startswith("Perm:") or _numeric_line(line):
+                continue
+
+            if line.startswith("Time:"):
+                timestep += 1
+
+            index.append((line, match.end() + 1, timestep))
+    finally:
+        buf.close()
+        fid.close()
+
+    def write(index_filename):
+        with open(index_filename, "w") as fid:
+            json.dump({"signature": file_signature([filename]),
+                       "index": index}, fid)
+
+    if cache:
+        write_cache(filename + ".index", write)
+
+    return index
+
+
+# ----------------------------------
+def _skip_lines(buf, offset, count):
+    """
+    Return the position in the buffer just after the next `count` lines
+    """
+    size = 4096 + 32 * count
+    while count > 0:
+        end = min(len(buf), offset + size)
+        chunk = np.frombuffer(buf[offset: end], dtype = np.uint8)
+        newlines = np.flatnonzero(chunk == ord('\n'))
+
+        if len(newlines) >= count:
+            return offset + newlines[count - 1] + 1
+
+        if end == len(buf):
+            if len(chunk) > 0 and len(newlines) == count - 1:
+                return end
+            raise ValueError("Unexpected end of file")
+
+        size *= 2
+
+    return offset
+
+
+# ---------------------------------------------
+def read_result_block(filename, offset, count):
+    """
+    Read a block of `count` values of a variable from an Elmer result file,
+    where `offset` is the position just after the line with the name of the
+    variable. That line is followed by the permutation of the nodes, unless
+    it's the same as for the previous variable, and then the values.
+    """
+    fid = open(filename, "rb")
+    buf = mmap.mmap(fid.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        start = _skip_lines(buf, offset, 1)
+        if buf[offset + 6: start].rstrip() != b"use previous":
+            start = _skip_lines(buf, start, count)
+
+        end = _skip_lines(buf, start, count)
+        values = np.fromstring(buf[start: end], sep = ' ')
+    finally:
+        buf.close()
+        fid.close()
+
+    if len(values) != count:
+        raise ValueError("Expected {0} values in {1}, found {2}"
+                         .format(count, filename, len(values)))
+
+    return values
+
+
+# ---------------------
+def get_timesteps(index):
+    """
+    Return the numbers of all the time steps in the index of a result file
+    """
+    return sorted(set(timestep for _, _, timestep in index if timestep > 0))
+
+
+# -----------------------------------------------------------
+def find_variable(index, variable, filename, timestep = None):
+    """
+    Return the offset in a result file of the block of values to read for
+    a variable, given the index of the file.
+
+    If `timestep` is None, this is the next-to-last line that contains the
+    name of the variable. Otherwise it's the block for the variable at that
+    time step, counting from 1, or from the end if `timestep` is negative,
+    e.g. -1 for the last one.
+    """
+    if timestep is None:
+        offsets = [offset for line, offset, _ in index if variable in line]
+        if len(offsets) < 2:
+            raise ValueError("Couldn't find the variable {0} in {1}"
+                             .format(variable, filename))
+
+        return offsets[-2]
+
+    if timestep < 0:
+        steps = get_timesteps(index)
+        if -timestep > len(steps):
+            raise ValueError("{0} only has {1} time steps"
+                             .format(filename, len(steps)))
+        timestep = steps[timestep]
+
+    for line, offset, step in index:
+        if step == timestep and line == variable:
+            return offset
+
+    raise ValueError("Couldn't find the variable {0} at time step {1} in {2}"
+                     .format(variable, timestep, filename))
+
+
+# ---------------------------------------------------
+def _partition_files(directory, filename, partitions):
+    """
+    Return the names of the .nodes file and the result file for each
+    partition of the Elmer output in `directory`
+    """
+    parts_directory = (normpath(directory) + "/partitioning."
+                       + str(partitions) + "/")
+
+    node_files = [parts_directory + "part." + str(p + 1) + ".nodes"
+                  for p in range(partitions)]
+    result_files = [normpath(directory) + "/" + filename + "." + str(p)
+                    for p in range(partitions)]
+
+    return node_files, result_files
+
+
+# ---------------------------------------------------
+def _store_signature(directory, filename, partitions):
+    """
+    Return the number of partitions followed by the modification time and
+    size of every .nodes and result file, or None if any of them are gone
+    """
+    node_files, result_files = _partition_files(directory, filename,
+                                                partitions)
+
+    try:
+        signature = file_signature(node_files + result_files)
+    except OSError:
+        return None
+
+    return np.array([partitions] + signature, dtype = np.float64)
+
+
+# ---------------------------------------
+def _store_directory(directory, filename):
+    return normpath(directory) + "/" + filename + ".store"
+
+
+# ---------------------------
+def _store_filename(variable):
+    return variable.replace(' ', '_') + ".npy"
+
+
+# ---------------------------------------------------------
+def _read_store(variables, directory, filename, partitions):
+    """
+    Return the variables from the store made by `convert_results`, or None
+    if there is no store, if it doesn't have all of the variables or if the
+    Elmer output has changed since it was made. The store is still used if
+    the original output files have been deleted.
+    """
+    def read(store):
+        stamp = np.load(store + "/signature.npy")
+        if len(stamp) == 0 or int(stamp[0]) != partitions:
+            return None
+
+        signature = _store_signature(directory, filename, partitions)
+        if signature is not None and not np.array_equal(stamp, signature):
+            return None
+
+        nodes = np.load(store + "/nodes.npy")
+        values = [np.load(store + "/" + _store_filename(variable))
+                  for variable in variables]
+
+        return nodes, values
+
+    stored = read_cache(_store_directory(directory, filename), read)
+    if stored is None:
+        return None
+
+    nodes, values = stored
+
+    data = np.empty(len(nodes),
+                    dtype = [('node', int),
+                             ('x', np.float64),
+                             ('y', np.float64),
+                             ('z', np.float64)] +
+                            [(variable, np.float64) for variable in variables]
+                    )
+
+    for name in ['node', 'x', 'y', 'z']:
+        data[name] = nodes[name]
+    for variable, value in zip(variables, values):
+        data[variable] = value
+
+    return data
+
+
+# -------------------------------
+def _read_partition_values(task):
+    """
+    Read the values of some variables from the result file for one
+    partition, given a tuple of the partition number, the filename, the
+    variables, the number of nodes in the partition and the time step
+    """
+    p, result_file, variables, count, timestep = task
+
+    index = index_result_file(result_file)
+    values = [read_result_block(result_file,
+                                find_variable(index, variable, result_file,
+                                              timestep),
+                                count)
+              for variable in variables]
+
+    return p, values
+
+
+# ---------------------------------------------------------------------------
+def iter_variables(variables, directory, filename, partitions,
+                   timesteps = None, verbose = False, jobs = 1):
+    """
+    Generate the values of several variables output by Elmer at a sequence
+    of time steps, e.g. to follow the iterations of an inversion. Only the
+    blocks of the result files for each time step are read as it's needed,
+    and the node coordinates are only read and sorted once.
+
+    Parameters:
+    ==========
+
+    variables:  list of names of the desired variables output by Elmer
+    directory:  path to the files output by Elmer
+    filename:   stem of the filename in `directory` where the results are
+                    stored, e.g. "Test_Robin_Beta.result" for Fabien's code
+    partitions: number of partitions of the underlying mesh
+    timesteps:  list of the time steps to read, as for `find_variable`;
+                    defaults to all of them
+    jobs:       number of processes to read the partitions with; by
+                    default they're read one after another in this process
+
+    Yields:
+    ======
+    timestep:   the time step, as given in `timesteps`
+    data:       a packed numpy array as returned by `get_variables`
+    """
+    node_files, result_files = _partition_files(directory, filename,
+                                                partitions)
+
+    if timesteps is None:
+        timesteps = get_timesteps(index_result_file(result_files[0]))
+
+    # The partitions are in separate files, so they can be read in parallel,
+    # but there's no point in more processes than partitions
+    jobs = max(1, min(jobs or 1, partitions))
+
+    pool = Pool(processes = jobs) if jobs > 1 else None
+    imap = pool.imap if pool else map
+    imap_unordered = pool.imap_unordered if pool else map
+
+    try:
+        # Read the .nodes file for each partition containing the location of
+        # each mesh point, so that we know how much space to allocate
+        nodes = []
+        for p, fields in enumerate(imap(read_nodes, node_files)):
+            nodes.append(fields)
+            if verbose:
+                print("Done reading geometry data for partition {0}"
+                      .format(p))
+
+        sizes = [len(node) for node, _, _, _ in nodes]
+        starts = np.concatenate(([0], np.cumsum(sizes))).astype(int)
+        nn = starts[-1]
+
+        if verbose:
+            print("Total number of data points: {0}".format(nn))
+
+        geometry = [np.concatenate([fields[k] for fields in nodes])
+                    for k in range(4)]
+        del nodes
+
+        # Sort the nodes by their coordinates once for all the time steps
+        node, x, y, z = geometry
+        order = np.lexsort((node, z, y, x))
+
+        dtype = ([('node', int),
+                  ('x', np.float64),
+                  ('y', np.float64),
+                  ('z', np.float64)] +
+                 [(variable, np.float64) for variable in variables])
+
+        for timestep in timesteps:
+            values = np.empty((len(variables), nn))
+
+            # Find where each field starts in each result file, read it and
+            # put it straight into its place as soon as it's ready
+            tasks = [(p, result_files[p], variables, sizes[p], timestep)
+                     for p in range(partitions)]
+            for p, block in imap_unordered(_read_partition_values, tasks):
+                for k, value in enumerate(block):
+                    values[k, starts[p]: starts[p + 1]] = value
+
+                if verbose:
+                    print("Done reading {0} for partition {1}"
+                          .format(", ".join(variables), p))
+
+            data = np.empty(nn, dtype = dtype)
+            for name, field in zip(['node', 'x', 'y', 'z'], geometry):
+                data[name] = field[order]
+            for k, variable in enumerate(variables):
+                data[variable] = values[k, order]
+
+            yield timestep, data
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+
+# ---------------------------------------------------------------------------
+def get_variables(variables, directory, filename, partitions, verbose = False,
+                  store = True, jobs = 1, timestep = None):
+    """
+    Read in several variables from output generated by Elmer, scanning each
+    result file only once
+
+    Parameters:
+    ==========
+
+    variables:  list of names of the desired variables output by Elmer
+    directory:  path to the files output by Elmer
+    filename:   stem of the filename in `directory` where the results are
+                    stored, e.g. "Test_Robin_Beta.result" for Fabien's code
+    partitions: number of partitions of the underlying mesh
+    store:      if True and the results have been converted with
+                    `convert_results`, read them from the converted store
+    jobs:       number of processes to read the partitions with; by
+                    default they're read one after another in this process
+    timestep:   the time step to read, as for `find_variable`; by default,
+                    the next-to-last block of each variable
+
+    Returns:
+    =======
+    data:       a packed numpy array consisting of the x, y, z locations of each
+                    node of the mesh along with the values of each of the
+                    desired fields at each mesh point, stored in a field with
+                    the same name as the variable
+    """
+    if store and timestep is None:
+        data = _read_store(variables, directory, filename, partitions)
+        if data is not None:
+            return data
+
+    generator = iter_variables(variables, directory, filename, partitions,
+                               [timestep], verbose, jobs)
+    try:
+        _, data = next(generator)
+    finally:
+        generator.close()
+
+    return data
+
+
 # --------------------------------------------------------------------------
 def get_variable(variable, directory, filename, partitions, verbose = False):
     """
@@ -77,137 +572,199 @@ def get_variable(variable, directory, filename, partitions, verbose = False):
                     node of the mesh along with the values of the desired field
                     at each mesh point
     """
+    data = get_variables([variable], directory, filename, partitions,
+                         verbose)
+    data.dtype.names = ('node', 'x', 'y', 'z', 'val')
 
-    dstart = np.zeros([2, partitions], dtype = np.int)
+    return data
 
-    parts_directory = (normpath(directory) + "/partitioning."
-                       + str(partitions) + "/")
 
-    # Get the lengths of all the node files
-    file_lengths = [bufcount(parts_directory + "part." + str(p) + ".nodes")
-                        for p in range(1, partitions + 1)]
+# ----------------------------------------
+def _group_columns(data, nodes_per_layer):
+    """
+    Assign each node to the vertical column that it lies in. If the mesh was
+    made by extruding a 2D mesh with `nodes_per_layer` nodes, the nodes of
+    each column are numbered k, k + nodes_per_layer, k + 2 * nodes_per_layer
+    and so forth, so they can be grouped by number. Otherwise, or if the
+    numbering doesn't follow that pattern, they're grouped by x and y.
 
-    nn = sum(file_lengths)
+    Returns:
+    =======
+    column:   the index of the column containing each node
+    ncolumns: the number of columns
+    """
+    x, y = data['x'], data['y']
 
-    if verbose:
-        print ("Total number of data points: {0}".format(nn))
+    if nodes_per_layer:
+        column = (data['node'] - 1) % nodes_per_layer
+        counts = np.bincount(column, minlength = nodes_per_layer)
 
-    data = np.empty(nn,
-                    dtype = [('node', np.int),
-                             ('x', np.float64),
-                             ('y', np.float64),
-                             ('z', np.float64),
-                             ('val', np.float64)]
-                    )
+        if np.all(counts > 0):
+            xc = np.empty(nodes_per_layer)
+            yc = np.empty(nodes_per_layer)
+            xc[column] = x
+            yc[column] = y
 
-    # For each partition,
-    for p in range(partitions):
-        if verbose:
-            print ("Reading data for partition {0}".format(p))
+            if np.all(x == xc[column]) and np.all(y == yc[column]):
+                return column, nodes_per_layer
 
-        # find the location in the data array where we'll start writing
-        start = sum(file_lengths[:p])
+    # Sort the nodes by x and y and number each distinct x, y pair in turn
+    order = np.lexsort((y, x))
+    xs, ys = x[order], y[order]
 
-        # and open the .nodes file containing the location of each mesh point.
-        node_file = open(parts_directory + "part." + str(p + 1) + ".nodes", "r")
-        points = node_file.readlines()
+    new_column = np.ones(len(data), dtype = bool)
+    new_column[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
 
-        # Fill in all the geometry data stored in this partition's node file.
-        for i in range(file_lengths[p]):
-            node, _, x, y, z = points[i].split()
-            data[start + i] = node, x, y, z, 0.0
+    column = np.empty(len(data), dtype = int)
+    column[order] = np.cumsum(new_column) - 1
 
-        del points
-        node_file.close()
+    return column, int(np.sum(new_column))
 
-        if verbose:
-            print ("    Done reading geometry data")
 
-        # Open the result file containing the data we're interested in
-        data_file = open(normpath(directory)
-                         + "/" + filename + "." + str(p), "r")
+# -----------------------------------------------------------------
+def get_layer(data, surface, field = 'val', nodes_per_layer = None):
+    """
+    Given one of the big data dumps from `get_variable`, which contains an
+    entire 3D field as output by Elmer, return a single 2D layer; either
+    the top or bottom surface or the depth-averaged value.
 
-        # Find the line number within the result file where our field starts
-        while 1:
-            line = data_file.readline()
-            if not line:
-                break
-            if variable in line:
-                dstart[0, p] = dstart[1, p]
-                dstart[1, p] = data_file.tell()
+    If `field` is a list of the fields of `data` rather than just one, the
+    layer is extracted from all of them at once and `q` is a list.
 
-        data_file.seek(0)
-        data_file.seek(dstart[0, p])
-        line = data_file.readline()
-        if line[6:] != "use previous\n":
-            for i in range(file_lengths[p]):
-                data_file.readline()
+    The columns are returned in order of their x- and y-coordinates, unless
+    `nodes_per_layer` is the number of nodes in the 2D mesh that the Elmer
+    mesh was extruded from, in which case they're in the same order as the
+    nodes of the 2D mesh; see `_group_columns`.
+    """
+    if surface not in ("top", "bottom", "average"):
+        raise NameError("Surface needs to be either top, "
+                        "bottom or average!")
+
+    fields = field if isinstance(field, (list, tuple)) else [field]
+
+    column, ncolumns = _group_columns(data, nodes_per_layer)
+
+    x = np.empty(ncolumns)
+    y = np.empty(ncolumns)
+    x[column] = data['x']
+    y[column] = data['y']
+
+    if surface == "average":
+        counts = np.bincount(column, minlength = ncolumns)
+        q = [np.bincount(column, weights = data[name],
+                         minlength = ncolumns) / counts
+             for name in fields]
+    else:
+        # Find the highest or lowest point of each column; if several nodes
+        # are at the same height, take the first one
+        z = data['z']
+        extreme = np.full(ncolumns, -np.inf if surface == "top" else np.inf)
+        if surface == "top":
+            np.maximum.at(extreme, column, z)
+        else:
+            np.minimum.at(extreme, column, z)
 
-        for i in range(file_lengths[p]):
-            data['val'][start + i] = float(data_file.readline())
+        hits = np.flatnonzero(z == extreme[column])
+        index = np.full(ncolumns, len(data), dtype = int)
+        np.minimum.at(index, column[hits], hits)
 
-        data_file.close()
+        q = [data[name][index] for name in fields]
 
-        if verbose:
-            print "    Done reading ", variable
+    if isinstance(field, (list, tuple)):
+        return x, y, q
 
-    data = np.sort(data, order = ['x', 'y', 'z'])
-    return data
+    return x, y, q[0]
 
 
-# --------------------------
-def get_layer(data, surface):
+# ------------------------------------------
+def save_mesh_permutation(xt, yt, elmer_dir):
     """
-    Given one of the big data dumps from `get_variable`, which contains an
-    entire 3D field as output by Elmer, return a single 2D layer; either
-    the top or bottom surface or the depth-averaged value.
+    Match up the columns of an extruded Elmer mesh with the nodes of the 2D
+    mesh it was made from, whose coordinates are `xt`, `yt`, and save the
+    permutation in the Elmer mesh directory, where `get_fields` will find it
     """
+    node, x, y, z = read_nodes(normpath(elmer_dir) + "/mesh.nodes")
 
-    # Make a function which will get the appropriate value from a vertical
-    # column of field values, depending on whether we want the top/bottom
-    # surface or depth-averaged value.
-    def function_to_get_field(surface):
-        if surface == "average":
-            def get_field_from_column(column):
-                return sum(column['val'])/len(column)
-        else:
-            if surface == "top":
-                argm = np.argmax
-            elif surface == "bottom":
-                argm = np.argmin
-            else:
-                raise NameError("Surface needs to be either top, "
-                                "bottom or average!")
-            def get_field_from_column(column):
-                index = argm(column['z'])
-                return column[index][4]
-
-        return get_field_from_column
+    data = np.empty(len(node), dtype = [('node', int),
+                                        ('x', np.float64),
+                                        ('y', np.float64),
+                                        ('z', np.float64)])
+    data['node'], data['x'], data['y'], data['z'] = node, x, y, z
 
-    get_field_from_column = function_to_get_field(surface)
+    xe, ye, _ = get_layer(data, "bottom", 'z', nodes_per_layer = len(xt))
 
-    x, y, q = [], [], []
+    return reconcile_elmer_with_mesh(xt, yt, xe, ye,
+                                     normpath(elmer_dir) + "/"
+                                     + permutation_filename)
 
-    # For each unique x- coordinate value,
-    for x_val in np.unique(data['x']):
-        # select all points that have the same x-value
-        data_x = data[ data['x'] == x_val ]
 
-        for y_val in np.unique(data_x['y']):
-            # Of those, select all points that have the same x- and y-value
-            data_column = data_x[ data_x['y'] == y_val ]
+# ---------------------------------------------------------------------
+def get_fields(requests, directory, partitions, mesh, timestep = None,
+               jobs = 1):
+    """
+    Get the values of several fields from Elmer's output, each on either the
+    top or bottom surface or averaged throughout a vertical column. The
+    result files are only scanned once and the nodes are only sorted and
+    matched up with the mesh once, no matter how many fields are requested.
 
-            field_val = get_field_from_column(data_column)
+    Parameters:
+    ==========
+    requests:   list of pairs (field, surface), e.g. [("beta", "bottom"),
+                ("velocity 1", "average")]; see `get_field`
+    directory:  path to the files output by Elmer
+    partitions: the number of partitions of the Elmer mesh
+    mesh:       a matplotlib.tri object encapsulating the original Triangle
+                mesh used to generated the Elmer mesh
+    timestep:   the time step to get the fields from; see `get_variables`
+    jobs:       number of processes to read the partitions with; see
+                `get_variables`
 
-            x.append(data_column[0][1])
-            y.append(data_column[0][2])
-            q.append(field_val)
+    Outputs:
+    =======
+    qs: list of the desired fields, in the same order as `requests`,
+        reconciled to the node ordering of `mesh`
+    """
+    filename = "Test_Robin_Beta.result"
 
-    return np.asarray(x), np.asarray(y), np.asarray(q)
+    variables = []
+    for field, surface in requests:
+        if field not in variables:
+            variables.append(field)
+
+    data = get_variables(variables,
+                         expanduser(directory),
+                         expanduser(filename),
+                         partitions,
+                         jobs = jobs,
+                         timestep = timestep)
+
+    surfaces = []
+    for field, surface in requests:
+        if surface not in surfaces:
+            surfaces.append(surface)
+
+    # If the Elmer mesh was extruded from the Triangle mesh, the nodes of
+    # each column can be found from their numbers alone
+    layers = {}
+    for surface in surfaces:
+        x, y, q = get_layer(data, surface, variables,
+                            nodes_per_layer = len(mesh.x))
+        layers[surface] = dict(zip(variables, q))
+
+    # All the layers have the same columns in the same order, so the
+    # permutation only has to be computed once, if it wasn't already saved
+    # with the Elmer mesh
+    permutation = reconcile_elmer_with_mesh(mesh.x, mesh.y, x, y,
+                                            normpath(expanduser(directory))
+                                            + "/" + permutation_filename)
+
+    return [layers[surface][field][permutation]
+            for field, surface in requests]
 
 
 # --------------------------------------------------------------------
-def get_field(field, directory, partitions, mesh, surface = "average"):
+def get_field(field, directory, partitions, mesh, surface = "average",
+              timestep = None, jobs = 1):
     """
     Get the values of a field from Elmer's output on either the top or
     bottom surface or averaged throughout a vertical column.
@@ -221,21 +778,86 @@ def get_field(field, directory, partitions, mesh, surface = "average"):
                 mesh used to generated the Elmer mesh
     surface:    either "top", "bottom" or "average"; the layer we want to
                 get the field from
+    timestep:   the time step to get the field from; see `get_variables`
+    jobs:       number of processes to read the partitions with; see
+                `get_variables`
 
     Outputs:
     =======
     q: the desired field, reconciled to the node ordering of `mesh`
     """
+    return get_fields([(field, surface)], directory, partitions, mesh,
+                      timestep, jobs)[0]
 
-    filename = "Test_Robin_Beta.result"
 
-    data = get_variable(field,
-                        expanduser(directory),
-                        expanduser(filename),
-                        partitions)
+# -----------------------------------------------------------------
+def convert_results(directory, filename, partitions, single = False,
+                    verbose = False):
+    """
+    Convert the output of a partitioned Elmer run to a compact binary store,
+    which `get_variables` and `get_field` will read from instead of the
+    text result files from then on.
+
+    The store is the directory "<directory>/<filename>.store", containing
+    the node numbers and coordinates in the file `nodes.npy`, sorted in the
+    same order as `get_variables` returns them, and the values of each
+    variable in a file of its own, e.g. `velocity_1.npy`. The variables are
+    the ones that `get_variables` would read, i.e. from the next-to-last
+    time step.
+
+    Parameters:
+    ==========
+    directory:  path to the files output by Elmer
+    filename:   stem of the result files, e.g. "Test_Robin_Beta.result"
+    partitions: number of partitions of the underlying mesh
+    single:     if True, store the values in single precision
+
+    Returns:
+    =======
+    variables:  list of the names of the variables in the store
+    """
+    _, result_files = _partition_files(directory, filename, partitions)
+
+    # Find all the variables in the result files
+    index = index_result_file(result_files[0])
+
+    variables = []
+    for line, offset, timestep in index:
+        if timestep == 0 or line.startswith("Time:") or line in variables:
+            continue
+
+        try:
+            find_variable(index, line, result_files[0])
+        except ValueError:
+            continue
+
+        variables.append(line)
+
+    data = get_variables(variables, directory, filename, partitions,
+                         verbose, store = False)
+
+    nodes = np.empty(len(data), dtype = [('node', int),
+                                         ('x', np.float64),
+                                         ('y', np.float64),
+                                         ('z', np.float64)])
+    for name in ['node', 'x', 'y', 'z']:
+        nodes[name] = data[name]
+
+    dtype = np.float32 if single else np.float64
+
+    def write(store):
+        os.mkdir(store)
+        np.save(store + "/nodes.npy", nodes)
+
+        for variable in variables:
+            np.save(store + "/" + _store_filename(variable),
+                    data[variable].astype(dtype))
 
-    x, y, q = get_layer(data, surface)
+        np.save(store + "/signature.npy",
+                _store_signature(directory, filename, partitions))
 
-    permutation = reconcile_elmer_with_mesh(mesh.x, mesh.y, x, y)
+    # Write everything to a temporary directory and move it into place once
+    # it's complete
+    write_atomically(_store_directory(directory, filename), write)
 
-    return q[permutation]
+    return variables
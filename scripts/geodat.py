@@ -1,11 +1,105 @@
 import numpy as np
 from scipy.io import *
-import struct
 import sys
 import math
 
 
-def read_geodat(filename):
+# -----------------------------------
+def _neighbor(new, old, i, j, di, dj):
+    """
+    Return the values at the (di, dj)-neighbors of the points (i, j) of a
+    grid, for a row `i` and an array of columns `j`, as they would be seen
+    by a loop over the grid in row-major order which updates the grid in
+    place: neighbors in the previous row or to the left have already been
+    visited and take their values from `new`, the rest still have their
+    values from `old`.
+    """
+    q = new if (di < 0 or (di == 0 and dj < 0)) else old
+    return q[i + di, j + dj]
+
+
+# ---------------
+def _differ(p, q):
+    return (p != q) & ((p == p) | (q == q))
+
+
+# ----------------------
+def _sweep(data, update):
+    """
+    Apply `update` to the interior of `data` with the same result as a
+    row-major loop that modifies `data` in place.
+
+    Each point only depends on the points before it in the order of the
+    loop, so the rows are done one after another. Within a row, the update
+    is repeated until it stops changing, but only at the points whose left
+    neighbor changed the last time, so that the cost is proportional to
+    the number of changes rather than to the length of the row times the
+    number of repetitions.
+    """
+    old = np.copy(data)
+    ny, nx = np.shape(data)
+
+    for i in range(1, ny - 1):
+        j = np.arange(1, nx - 1)
+        while len(j) > 0:
+            q = update(data, old, i, j)
+            changed = _differ(q, data[i, j])
+            j = j[changed]
+            data[i, j] = q[changed]
+
+            # Only the right neighbors of the points that just changed
+            # have to be done again
+            j = j[j < nx - 2] + 1
+
+
+# ------------------------
+def fix_weird_points(data):
+    """
+    Clean up the missing data in a velocity mosaic, in place.
+
+    Points with no data but whose four cardinal neighbors do have data are
+    filled in with the average of those neighbors, and isolated points with
+    data are removed. This gives the same output as visiting each interior
+    point in turn, but does the work with array operations.
+    """
+    nbrs8 = [(1, 1), (1, 0), (1, -1), (0, 1),
+             (0, -1), (-1, 1), (-1, 0), (-1, -1)]
+
+    def count_nbrs(new, old, i, j):
+        return sum((_neighbor(new, old, i, j, di, dj) != -2e+9).astype(int)
+                   for di, dj in nbrs8)
+
+    def first_pass(new, old, i, j):
+        q = old[i, j]
+        missing = q == -2e+9
+
+        # A point with no data but which has four cardinal neighbors
+        # that does can rasonably have data interpolated from them
+        nbrs = [_neighbor(new, old, i, j, di, dj)
+                for di, dj in [(1, 0), (-1, 0), (0, 1), (0, -1)]]
+        fill = missing & np.all([nbr != -2e+9 for nbr in nbrs], axis = 0)
+        q[fill] = (((nbrs[0] + nbrs[1]) + nbrs[2]) + nbrs[3])[fill] / 4.0
+
+        # A point which does have data but for which only one of its
+        # neighbors neighbors does should not have data
+        q[~missing & (count_nbrs(new, old, i, j) <= 1)] = -2e+9
+
+        return q
+
+    def second_pass(new, old, i, j):
+        q = old[i, j]
+        q[(q != -2e+9) & (count_nbrs(new, old, i, j) < 4)] = -2e+9
+        return q
+
+    _sweep(data, first_pass)
+    _sweep(data, second_pass)
+
+    return data
+
+
+# -----------------------------------------------------
+def read_geodat(filename, xmin = -np.inf, xmax = np.inf,
+                          ymin = -np.inf, ymax = np.inf):
     """
     Read in one of Ian's geodat files.
 
@@ -14,6 +108,8 @@ def read_geodat(filename):
     filename: the name of the geodat file to read; expects that there is
               also a file called "filename.geodat", which contains info
               on grid size, spacing, etc.
+    xmin, xmax, ymin, ymax: optional window; only the pixels inside this
+              rectangle are read from disk
 
     Returns:
     =======
@@ -48,62 +144,38 @@ def read_geodat(filename):
     dx, dy = xgeo[1, :]
     xo, yo = xgeo[2, :]
 
-    x = np.zeros(nx)
-    for i in range(nx):
-        x[i] = xo + i * dx
+    x = xo + dx * np.arange(nx)
+    y = yo + dy * np.arange(ny)
 
-    y = np.zeros(ny)
-    for i in range(ny):
-        y[i] = yo + i * dy
+    # Find the pixel window to read
+    j0 = int( max(  0, (xmin - xo) / dx )     )
+    j1 = int( min( nx, (xmax - xo) / dx + 1 ) )
+    i0 = int( max(  0, (ymin - yo) / dy )     )
+    i1 = int( min( ny, (ymax - yo) / dy + 1 ) )
 
-    # Open the x-velocity file and read in all the binary data
-    data_file = open(filename, "rb")
-    raw_data = data_file.read()
-    data_file.close()
+    # A window that misses the raster altogether is empty, rather than
+    # wrapping around to the other side of it
+    j1 = max(j0, min(nx, j1))
+    i1 = max(i0, min(ny, i1))
 
-    # Unpack that binary data to an array of floats, knowing that it is
-    # in big-endian format. Why? God only knows.
-    nvals = len(raw_data)/4
-    arr = np.zeros(nvals)
-    for i in range(nvals):
-        arr[i] = struct.unpack('>f', raw_data[4*i: 4*(i+1)])[0]
+    # Map the binary file as an array of floats, knowing that it is in
+    # big-endian format. Why? God only knows. Only the pixels inside the
+    # window are actually read from disk.
+    raw_data = np.memmap(filename, dtype = '>f4', mode = 'r',
+                         shape = (ny, nx))
 
     # Fairly certain that this is right, but plot it and compare against
     # matlab to be certain
-    data = arr.reshape((ny, nx))
+    data = np.array(raw_data[i0:i1, j0:j1], dtype = np.float64)
+    del raw_data
+
+    x = x[j0:j1]
+    y = y[i0:i1]
+    ny, nx = np.shape(data)
 
     # Find weird points.
-    if np.min(data) == -2.0e+9:
-        for i in range(1, ny - 1):
-            for j in range(1, nx - 1):
-                # A point with no data but which has four cardinal neighbors
-                # that does can rasonably have data interpolated from them
-                if data[i, j] == -2e+9:
-                    nbrs = [ [i+1, i-1, i,   i  ],
-                             [j,   j,   j+1, j-1] ]
-                    k = sum( data[nbrs[0], nbrs[1]] != -2e+9 )
-                    if k == 4:
-                        data[i,j] = sum( data[nbrs[0],nbrs[1]] )/4.0
-
-                # A point which does have data but for which only one of its
-                # neighbors neighbors does should not have data
-                else:
-                    nbrs = [ [i+1, i+1, i+1, i,   i,   i-1, i-1, i-1],
-                             [j+1, j,   j-1, j+1, j-1, j+1, j,   j-1] ]
-                    k = sum( data[nbrs[0],nbrs[1]]!=-2e+9 )
-                    if k <= 1:
-                        data[i,j] = -2e+9
-                        data[i,j] = -2e+9
-
-        for i in range(1, ny - 1):
-            for j in range(1, nx - 1):
-                if data[i,j] != -2e+9:
-                    nbrs = [ [i+1, i+1, i+1, i,   i,   i-1, i-1, i-1],
-                             [j+1, j,   j-1, j+1, j-1, j+1, j,   j-1] ]
-                    k = sum( data[nbrs[0], nbrs[1]] != -2e+9 )
-                    if k < 4:
-                        data[i,j] = -2e+9
-                        data[i,j] = -2e+9
+    if data.size > 0 and np.min(data) == -2.0e+9:
+        fix_weird_points(data)
 
     return x, y, data
 
@@ -13,28 +13,60 @@ def readgeotif(filename,xmin=-np.Inf,xmax=np.Inf,ymin=-np.Inf,ymax=np.Inf):
     nx = geotiffile.RasterXSize
     ny = geotiffile.RasterYSize
 
-    # Load the data from the file
-    z = np.zeros((ny,nx))
-    z = geotiffile.GetRasterBand(1).ReadAsArray()
-    z = z[::-1,:]
-
     # Get the coordinates of the image
     gt = geotiffile.GetGeoTransform()
-    x = np.zeros(nx)
-    y = np.zeros(ny)
-    for i in range(nx):
-        x[i] = gt[0]+i*gt[1]
-    for i in range(ny):
-        y[i] = gt[3]+i*gt[5]
+    x = gt[0] + gt[1]*np.arange(nx)
+    y = gt[3] + gt[5]*np.arange(ny)
     y = y[::-1]
 
     dx = math.fabs(gt[1])
     dy = math.fabs(gt[5])
 
+    # Translate the window to pixel offsets
     j0 = int( max(  0, (xmin-x[0])/dx )   )
     j1 = int( min( nx, (xmax-x[0])/dx )+1 )
     i0 = int( max(  0, (ymin-y[0])/dy )   )
     i1 = int( min( ny, (ymax-y[0])/dy )+1 )
 
+    j1 = max(j0, min(nx, j1))
+    i1 = max(i0, min(ny, i1))
+
+    if j1 == j0 or i1 == i0:
+        return (x[j0:j1],y[i0:i1],np.zeros((i1-i0,j1-j0)))
+
+    # Load only the window from the file; the rows are stored from north to
+    # south, so the window is flipped along with the data
+    z = geotiffile.GetRasterBand(1).ReadAsArray(j0,ny-i1,j1-j0,i1-i0)
+    z = z[::-1,:]
+
+    return (x[j0:j1],y[i0:i1],z)
+
+
+def geotif_tiles(filename):
+    '''
+    Iterate over a geotif file one block at a time, for rasters too big to
+    load into memory. The blocks follow the internal tiling of the file so
+    that each one can be read without touching any others. Yields the
+    coordinates and data of each block, in the same orientation as
+    `readgeotif`.
+    '''
+    geotiffile = gdal.Open(filename,gdal.GA_ReadOnly)
+    band = geotiffile.GetRasterBand(1)
+
+    nx = geotiffile.RasterXSize
+    ny = geotiffile.RasterYSize
+    bx, by = band.GetBlockSize()
+
+    gt = geotiffile.GetGeoTransform()
+
+    for yoff in range(0,ny,by):
+        ysize = min(by,ny-yoff)
+        y = gt[3] + gt[5]*np.arange(yoff,yoff+ysize)
+
+        for xoff in range(0,nx,bx):
+            xsize = min(bx,nx-xoff)
+            x = gt[0] + gt[1]*np.arange(xoff,xoff+xsize)
+
+            z = band.ReadAsArray(xoff,yoff,xsize,ysize)
 
-    return (x[j0:j1],y[i0:i1],z[i0:i1,j0:j1])
+            yield (x,y[::-1],z[::-1,:])
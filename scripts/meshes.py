@@ -1,5 +1,10 @@
 from geodat import *
+from build import file_signature, read_cache, write_cache
 import math
+import os
+import re
+
+from scipy import sparse
 
 
 # ------------
@@ -8,40 +13,235 @@ def area(x, y):
                         (x[2] - x[0]) * (y[1] - y[0]))
 
 
-# -----------------------------------------
-def gridded_to_point_cloud(x, y, xq, yq, q):
+# -----------------------------------------------------------
+def gridded_to_point_cloud(x, y, xq, yq, q, fill_value = None):
     """
     Interpolate gridded data to a point cloud
 
     Arguments
     =========
-    x, y:   coordinates of the point cloud
-    xq, yq: positions of the regular grid
-    q:      gridded data set
+    x, y:       coordinates of the point cloud
+    xq, yq:     positions of the regular grid
+    q:          gridded data set, or a list of gridded data sets all defined
+                on the same grid
+    fill_value: value to use at points outside the grid; if None, these
+                points get the value at the nearest point of the grid
 
     Returns:
     =======
-    r: gridded data set, interpolated to x, y
+    r: gridded data set, interpolated to x, y, or a list of them if `q` is
+       a list; the interpolation weights are only computed once for all of
+       the data sets
     """
+    x = np.asarray(x)
+    y = np.asarray(y)
 
-    nn = len(x)
-    r = np.zeros(nn, dtype = np.float64)
+    nx = len(xq)
+    ny = len(yq)
 
     dx = xq[1] - xq[0]
     dy = yq[1] - yq[0]
 
-    for k in range(nn):
-        i = int( (y[k] - yq[0]) / dy )
-        j = int( (x[k] - xq[0]) / dx )
+    # Find the grid cell that each point lies in; points on the last row or
+    # column of the grid and points outside it use the nearest cell
+    i = np.clip(np.floor((y - yq[0]) / dy).astype(int), 0, ny - 2)
+    j = np.clip(np.floor((x - xq[0]) / dx).astype(int), 0, nx - 2)
+
+    ay = np.clip((y - yq[i]) / dy, 0.0, 1.0)
+    ax = np.clip((x - xq[j]) / dx, 0.0, 1.0)
+
+    outside = (x < xq[0]) | (x > xq[-1]) | (y < yq[0]) | (y > yq[-1])
+
+    def interpolate(q):
+        r = (q[i, j] + ax*(q[i, j+1] - q[i, j])
+                     + ay*(q[i+1, j] - q[i, j])
+                     + ax*ay*(q[i, j] + q[i+1, j+1] - q[i, j+1] - q[i+1, j]))
 
-        ay = (y[k] - yq[i]) / dy
-        ax = (x[k] - xq[j]) / dx
+        if fill_value is not None:
+            r[outside] = fill_value
 
-        r[k] = (q[i, j] + ax*(q[i, j+1] - q[i, j])
-                        + ay*(q[i+1, j] - q[i, j])
-                        + ax*ay*(q[i, j] + q[i+1, j+1] - q[i, j+1] - q[i+1, j]))
+        return r
 
-    return r
+    if isinstance(q, (list, tuple)):
+        return [interpolate(field) for field in q]
+
+    return interpolate(q)
+
+
+# ---------------------------------------------------
+def barycentric_weights(x, y, ele, triangle, xp, yp):
+    """
+    Compute the weights for linearly interpolating a field defined on the
+    nodes of a triangular mesh to a set of points
+
+    Arguments
+    =========
+    x, y:     coordinates of the mesh nodes
+    ele:      indices of the nodes of each triangle
+    triangle: index of the triangle containing each point, or -1 if it isn't
+              in the mesh, e.g. as found by a matplotlib trifinder
+    xp, yp:   coordinates of the points
+
+    Returns:
+    =======
+    w: array of the barycentric coordinates of each point with respect to
+       the three nodes of its triangle; all zero for points outside the mesh
+    """
+    triangle = np.asarray(triangle)
+    xp = np.asarray(xp, dtype = np.float64)
+    yp = np.asarray(yp, dtype = np.float64)
+
+    inside = triangle != -1
+    nodes = ele[np.where(inside, triangle, 0)]
+
+    x0, x1, x2 = x[nodes[:, 0]], x[nodes[:, 1]], x[nodes[:, 2]]
+    y0, y1, y2 = y[nodes[:, 0]], y[nodes[:, 1]], y[nodes[:, 2]]
+
+    det = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+    det = np.where(inside, det, 1.0)
+
+    w = np.zeros((len(xp), 3))
+    w[:, 1] = ((xp - x0) * (y2 - y0) - (x2 - x0) * (yp - y0)) / det
+    w[:, 2] = ((x1 - x0) * (yp - y0) - (xp - x0) * (y1 - y0)) / det
+    w[:, 0] = 1.0 - w[:, 1] - w[:, 2]
+    w[~inside, :] = 0.0
+
+    return w
+
+
+# -----------------------
+def _read_lines(filename):
+    """
+    Read all of the lines of one of Triangle's files that aren't blank,
+    without any comments, which start with '#' and run to the end of the line
+    """
+    fid = open(filename, 'r')
+    lines = re.sub('#[^\n]*', '', fid.read()).split('\n')
+    fid.close()
+
+    return [line for line in lines if line.strip()]
+
+
+# -------------------------------------
+def _read_header(lines, start, defaults, filename):
+    """
+    Read the integers on the header line of a section of one of Triangle's
+    files; any that are left out take the values from `defaults`
+    """
+    if len(lines) <= start:
+        raise ValueError("Unexpected end of file in {0}".format(filename))
+
+    header = [int(float(word)) for word in lines[start].split()]
+
+    return (header + defaults[len(header):])[:len(defaults)]
+
+
+# -----------------------------------------------------
+def _read_table(lines, start, rows, columns, filename):
+    """
+    Parse the first `columns` numbers on each of the `rows` lines starting
+    from line `start`, along with the line just after the end of the table.
+    Triangle ignores anything after the fields it needs on each line, so
+    there may be more columns than that in the file.
+    """
+    end = start + rows
+    if len(lines) < end:
+        raise ValueError("Unexpected end of file in {0}".format(filename))
+
+    # Parse the whole table in one go if every line has the same number of
+    # fields, which is nearly always the case
+    numbers = np.fromstring(' '.join(lines[start: end]), sep = ' ')
+    width = len(lines[start].split()) if rows > 0 else columns
+    if len(numbers) == rows * width and width >= columns:
+        table = numbers.reshape((rows, width))[:, :columns]
+    else:
+        table = np.array([line.split()[:columns]
+                          for line in lines[start: end]], dtype = np.float64)
+
+    if table.shape != (rows, columns):
+        raise ValueError("Expected {0} fields on each line of a table in {1}"
+                         .format(columns, filename))
+
+    return table, end
+
+
+# -------------------------------------------
+def _read_vertices(lines, start, filename):
+    """
+    Read a list of vertices in the format of a .node file, starting with its
+    header line. Returns the coordinates,
+    attributes and boundary markers of the vertices, the number of the first
+    vertex and the position just after the list.
+    """
+    nn, dim, na, nb = _read_header(lines, start, [0, 2, 0, 0], filename)
+    if dim != 2:
+        raise ValueError("Expected 2D vertices in {0}, found {1}D"
+                         .format(filename, dim))
+
+    table, end = _read_table(lines, start + 1, nn, 3 + na + nb, filename)
+
+    x = np.copy(table[:, 1])
+    y = np.copy(table[:, 2])
+    attributes = np.copy(table[:, 3: 3 + na])
+    bnd = np.zeros(nn, dtype = np.int32)
+    if nb:
+        bnd[:] = table[:, 3 + na]
+
+    first = int(table[0, 0]) if nn > 0 else 1
+
+    return x, y, attributes, bnd, first, end
+
+
+# ---------------------
+def read_node(filename):
+    """
+    Read in a .node file in Triangle's format.
+
+    Arguments
+    =========
+    filename: path to the .node file
+
+    Returns
+    =======
+    x, y:       coordinates of the vertices
+    attributes: array of the attributes of each vertex, with one column for
+                each attribute
+    bnd:        boundary markers of each vertex, or all zeros if the file
+                doesn't have any
+    """
+    x, y, attributes, bnd, _, _ = \
+        _read_vertices(_read_lines(filename), 0, filename)
+
+    return x, y, attributes, bnd
+
+
+# ---------------------------------
+def read_ele(filename, first = 1):
+    """
+    Read in a .ele file in Triangle's format.
+
+    Arguments
+    =========
+    filename: path to the .ele file
+    first:    number of the first vertex, which is either 0 or 1 depending
+              on how the .node file was numbered
+
+    Returns
+    =======
+    ele:        zero-based indices of the vertices of each triangle; there
+                are 6 columns rather than 3 for second-order meshes
+    attributes: array of the attributes of each triangle, with one column
+                for each attribute
+    """
+    lines = _read_lines(filename)
+
+    ne, npe, na = _read_header(lines, 0, [0, 3, 0], filename)
+    table, end = _read_table(lines, 1, ne, 1 + npe + na, filename)
+
+    ele = table[:, 1: 1 + npe].astype(np.int32) - first
+    attributes = np.copy(table[:, 1 + npe:])
+
+    return ele, attributes
 
 
 # ---------------------
@@ -65,44 +265,67 @@ def read_poly(filename):
     xh, yh : numpy array of doubles
         coordinates of holes
     """
-    fid = open(filename,'r')
+    lines = _read_lines(filename)
 
-    # Read in the coordinates of the boundary pointers
-    nn = int(fid.readline().split()[0])
-
-    x = np.zeros(nn)
-    y = np.zeros(nn)
-    bnd = np.zeros(nn,dtype=np.int)
-    for i in range(nn):
-        line = fid.readline().split()
-        x[i] = float(line[1])
-        y[i] = float(line[2])
-        bnd[i] = int(line[3])
+    # Read in the coordinates of the boundary points; if there are none,
+    # they're kept in a .node file of the same name instead
+    x, y, _, bnd, first, end = _read_vertices(lines, 0, filename)
+    if len(x) == 0:
+        node_filename = os.path.splitext(filename)[0] + ".node"
+        x, y, _, bnd, first, _ = \
+            _read_vertices(_read_lines(node_filename), 0, node_filename)
 
     # Read in the edges
-    ne = int(fid.readline().split()[0])
-
-    edge = np.zeros((ne,2),dtype=np.int)
-    for i in range(nn):
-        line = fid.readline().split()
-        edge[i,0] = int(line[1])-1
-        edge[i,1] = int(line[2])-1
+    ns, nsb = _read_header(lines, end, [0, 0], filename)
+    table, end = _read_table(lines, end + 1, ns, 3 + nsb, filename)
+    edge = table[:, 1:3].astype(np.int32) - first
 
     # Read in the holes
-    nh = int(fid.readline().split()[0])
+    nh, = _read_header(lines, end, [0], filename)
+    table, end = _read_table(lines, end + 1, nh, 3, filename)
 
-    xh = np.zeros(nh)
-    yh = np.zeros(nh)
-    for i in range(nh):
-        line = fid.readline().split()
-        xh[i] = float(line[1])
-        yh[i] = float(line[2])
+    xh = np.copy(table[:, 1])
+    yh = np.copy(table[:, 2])
 
     return x, y, bnd, edge, xh, yh
 
 
-# ------------------------------
-def read_triangle_mesh(filename):
+# ---------------------------
+def _mesh_signature(filename):
+    return file_signature([filename + ".node", filename + ".ele"])
+
+
+# -----------------------------
+def _read_mesh_cache(filename):
+    """
+    Return the mesh stored in the binary file `filename.npz`, or None if
+    there isn't one or if the .node or .ele files have changed since.
+    """
+    def read(cache_filename):
+        cache = np.load(cache_filename)
+        try:
+            if not np.array_equal(cache["signature"],
+                                  _mesh_signature(filename)):
+                return None
+            return cache["x"], cache["y"], cache["ele"], cache["bnd"]
+        finally:
+            cache.close()
+
+    return read_cache(filename + ".npz", read)
+
+
+# ----------------------------------------------
+def _write_mesh_cache(filename, x, y, ele, bnd):
+    def write(cache_filename):
+        with open(cache_filename, 'wb') as fid:
+            np.savez(fid, signature = _mesh_signature(filename),
+                     x = x, y = y, ele = ele, bnd = bnd)
+
+    write_cache(filename + ".npz", write)
+
+
+# ----------------------------------------------
+def read_triangle_mesh(filename, cache = True):
     """
     Function to read in an unstructured grid in Triangle's format.
 
@@ -111,6 +334,9 @@ def read_triangle_mesh(filename):
     filename: stem for the Triangle files, e.g. for the triangulation stored
               in the files {path/my_tri.node, path/my_tri.ele, ...}, this
               would be `path/my_tri`.
+    cache:    if True, keep a binary copy of the mesh in `path/my_tri.npz`
+              and read from it instead as long as the .node and .ele files
+              haven't been modified since
 
     Returns
     =======
@@ -118,24 +344,103 @@ def read_triangle_mesh(filename):
     ele:  indices of each triangle
     bnd:  boundary indicators for each vertex
     """
-    fid = open(filename + ".node", "r")
-    nn = int( fid.readline().split()[0] )
-    x = np.zeros(nn)
-    y = np.zeros(nn)
-    bnd = np.zeros(nn, dtype = np.int32)
-    for i in range(nn):
-        line = fid.readline().split()
-        x[i] = float(line[1])
-        y[i] = float(line[2])
-        bnd[i] = int(line[3])
-    fid.close()
+    if cache:
+        mesh = _read_mesh_cache(filename)
+        if mesh is not None:
+            return mesh
 
-    fid = open(filename + ".ele", "r")
-    ne = int( fid.readline().split()[0] )
-    ele = np.zeros((ne, 3), dtype=np.int32)
-    for i in range(ne):
-        ele[i,:] = map(int, fid.readline().split()[1:])
-        ele[i,:] = ele[i,:] - np.ones(3)
-    fid.close()
+    node_filename = filename + ".node"
+    x, y, _, bnd, first, _ = \
+        _read_vertices(_read_lines(node_filename), 0, node_filename)
+
+    ele, _ = read_ele(filename + ".ele", first)
+
+    if cache:
+        _write_mesh_cache(filename, x, y, ele, bnd)
 
     return x, y, ele, bnd
+
+
+# ------------------------------------------------------
+def interpolation_matrix(x, y, ele, triangle, xp, yp):
+    """
+    Make a sparse matrix which linearly interpolates a field defined on the
+    nodes of a triangular mesh to a set of points; the arguments are the
+    same as for `barycentric_weights`. Rows for points outside the mesh are
+    empty.
+    """
+    triangle = np.asarray(triangle)
+    w = barycentric_weights(x, y, ele, triangle, xp, yp)
+
+    inside = np.flatnonzero(triangle != -1)
+    rows = np.repeat(inside, 3)
+    cols = ele[triangle[inside]].ravel()
+
+    return sparse.csr_matrix((w[inside].ravel(), (rows, cols)),
+                             shape = (len(xp), len(x)))
+
+
+# -----------------------------------------------------------------
+def grid_interpolation_operator(filename, tri, x, y, cache = True):
+    """
+    Get the sparse matrix which linearly interpolates a field defined on the
+    nodes of a Triangle mesh to the points (x[j], y[i]) of a regular grid,
+    so that the gridded field is `A.dot(q).reshape((len(y), len(x)))`.
+
+    Arguments
+    =========
+    filename: stem of the Triangle mesh files, as for `read_triangle_mesh`
+    tri:      a matplotlib Triangulation of the same mesh, which is only
+              used if the operator has to be computed
+    x, y:     coordinates of the grid
+    cache:    if True, keep the operator in `filename.grid.npz` and read it
+              from there instead as long as the mesh files haven't been
+              modified and the grid is the same
+
+    Returns:
+    =======
+    A:      the interpolation matrix
+    inside: boolean array which is True for the grid points in the mesh,
+            with the same shape as the grid
+    """
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    cache_filename = filename + ".grid.npz"
+
+    def read(cache_filename):
+        saved = np.load(cache_filename)
+        try:
+            if not (np.array_equal(saved["signature"],
+                                   _mesh_signature(filename)) and
+                    np.array_equal(saved["x"], x) and
+                    np.array_equal(saved["y"], y)):
+                return None
+            A = sparse.csr_matrix((saved["data"], saved["indices"],
+                                   saved["indptr"]),
+                                  shape = tuple(saved["shape"]))
+            return A, saved["inside"]
+        finally:
+            saved.close()
+
+    if cache:
+        operator = read_cache(cache_filename, read)
+        if operator is not None:
+            return operator
+
+    X, Y = np.meshgrid(x, y)
+    X, Y = X.ravel(), Y.ravel()
+
+    triangle = np.asarray(tri.get_trifinder()(X, Y), dtype = int)
+    A = interpolation_matrix(tri.x, tri.y, tri.triangles, triangle, X, Y)
+    inside = (triangle != -1).reshape((len(y), len(x)))
+
+    def write(cache_filename):
+        with open(cache_filename, 'wb') as fid:
+            np.savez(fid, signature = _mesh_signature(filename),
+                     x = x, y = y, data = A.data, indices = A.indices,
+                     indptr = A.indptr, shape = A.shape, inside = inside)
+
+    if cache:
+        write_cache(cache_filename, write)
+
+    return A, inside
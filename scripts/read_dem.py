@@ -1,18 +1,102 @@
 import numpy as np
+from build import file_signature, read_cache, write_cache
+
+
+# ------------------------
+def _read_cache(filename):
+    """
+    Return the DEM stored in the binary sidecar file for `filename`, or None
+    if there isn't one or if it's out of date.
+    """
+    def read(cache_filename):
+        arr = np.load(cache_filename, mmap_mode = 'c')
+
+        if arr.ndim != 1 or len(arr) < 4:
+            return None
+        if not np.array_equal(arr[0:2], file_signature([filename])):
+            return None
+
+        nx, ny = int(arr[2]), int(arr[3])
+        if len(arr) != 4 + nx + ny + nx * ny:
+            return None
+
+        x = arr[4: 4 + nx]
+        y = arr[4 + nx: 4 + nx + ny]
+        q = arr[4 + nx + ny:].reshape((ny, nx))
+
+        return x, y, q
+
+    return read_cache(filename + ".npy", read)
+
+
+# ---------------------------------
+def _write_cache(filename, x, y, q):
+    """
+    Write a DEM to a binary sidecar file, which consists of the modification
+    time and size of the original file, the grid dimensions, the grid
+    coordinates and the data, all as one flat array of doubles.
+    """
+    nx, ny = len(x), len(y)
+    arr = np.concatenate((file_signature([filename]), [nx, ny],
+                          x, y, q.ravel()))
+
+    def write(cache_filename):
+        with open(cache_filename, 'wb') as fid:
+            np.save(fid, arr)
+
+    write_cache(filename + ".npy", write)
+
+
+# ---------------------------------
+def read_dem(filename, cache = True):
+    """
+    Read in a gridded data set in the .xy format that Elmer reads.
+
+    Parameters:
+    ==========
+    filename: path to the .xy file
+    cache:    if True, keep a binary copy of the data next to the .xy file,
+              i.e. "filename.npy", and read from it instead as long as the
+              .xy file hasn't been modified since
+
+    Returns:
+    =======
+    x, y: the grid coordinates
+    q:    the gridded data, indexed as q[i, j] for the point (x[j], y[i])
+    """
+    if cache:
+        dem = _read_cache(filename)
+        if dem is not None:
+            return dem
 
-def read_dem(filename):
     fid = open(filename, 'r')
 
     nx = int(fid.readline().split()[0])
     ny = int(fid.readline().split()[0])
 
-    x = np.zeros(nx)
-    y = np.zeros(ny)
+    # Parse all the data in one go; the points are stored with x varying
+    # slowest, i.e. in column-major order.
+    data = np.fromstring(fid.read(), sep = ' ')
+
+    fid.close()
+
+    if len(data) != 3 * nx * ny:
+        raise ValueError("Expected {0} values in {1}, found {2}"
+                         .format(3 * nx * ny, filename, len(data)))
+
+    data = data.reshape((nx, ny, 3))
+
+    x = np.copy(data[:, 0, 0])
+    y = np.copy(data[0, :, 1])
+
+    if not (np.all(data[:, :, 0] == x[:, np.newaxis]) and
+            np.all(data[:, :, 1] == y[np.newaxis, :])):
+        raise ValueError("Points in {0} don't lie on a regular grid in the"
+                         " expected order".format(filename))
 
-    q = np.zeros((ny, nx))
+    q = np.ascontiguousarray(data[:, :, 2].T)
 
-    for j in range(nx):
-        for i in range(ny):
-            x[j], y[i], q[i,j] = map(float, fid.readline().split())
+    if cache:
+        _write_cache(filename, x, y, q)
 
     return x, y, q
@@ -0,0 +1,51 @@
+import numpy as np
+from scipy import interpolate
+from scipy import ndimage
+
+
+# ------------------------------------------------------------
+def resample(x, y, q, xt, yt, order = 3, no_data = -2.0e+9):
+    """
+    Interpolate a gridded data set to another grid.
+
+    Parameters:
+    ==========
+    x, y:    coordinates of the grid that the data are given on
+    q:       gridded data set, indexed as q[i, j] for the point (x[j], y[i])
+    xt, yt:  coordinates of the target grid; both must be increasing
+    order:   degree of the interpolating spline; 1 gives bilinear
+             interpolation
+    no_data: value marking missing data; any target point lying in a cell of
+             the input grid with a missing corner is marked as missing too
+
+    Returns:
+    =======
+    r: the data interpolated to the target grid, indexed as r[i, j] for
+       the point (xt[j], yt[i])
+    """
+    missing = q == no_data
+
+    # Fill in the missing points with the value at the nearest point that
+    # has data, so that the huge no-data value doesn't throw off the spline
+    # at all the points around it
+    if missing.any() and not missing.all():
+        indices = ndimage.distance_transform_edt(missing,
+                                                 return_distances = False,
+                                                 return_indices = True)
+        q = q[indices[0], indices[1]]
+
+    # Evaluate the spline on the whole target grid at once
+    spline = interpolate.RectBivariateSpline(x, y, q.T, kx = order, ky = order)
+    r = spline(xt, yt).T
+
+    if missing.any():
+        # Find which cell of the input grid each target point lies in
+        i = np.clip(np.searchsorted(y, yt, side = 'right') - 1, 0, len(y) - 2)
+        j = np.clip(np.searchsorted(x, xt, side = 'right') - 1, 0, len(x) - 2)
+
+        missing_cell = (missing[:-1, :-1] | missing[1:, :-1]
+                        | missing[:-1, 1:] | missing[1:, 1:])
+
+        r[missing_cell[np.ix_(i, j)]] = no_data
+
+    return r
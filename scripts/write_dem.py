@@ -0,0 +1,36 @@
+import numpy as np
+
+
+# ----------------------------------------------------------
+def write_dem(filename, x, y, q, fmt = "%.12g", chunk_size = 65536):
+    """
+    Write out a gridded data set in the .xy format that Elmer reads.
+
+    Parameters:
+    ==========
+    filename:   path to the output .xy file
+    x, y:       the grid coordinates
+    q:          the gridded data, indexed as q[i, j] for the point (x[j], y[i])
+    fmt:        format for each number
+    chunk_size: number of points to format at once
+    """
+    nx = len(x)
+    ny = len(y)
+
+    # The points are written with x varying slowest, which is the order that
+    # the Fortran routines in Init.f90 read them in.
+    X = np.repeat(np.asarray(x, dtype = np.float64), ny)
+    Y = np.tile(np.asarray(y, dtype = np.float64), nx)
+    Q = np.asarray(q, dtype = np.float64).T.ravel()
+
+    line = "{0} {0} {0}\n".format(fmt)
+
+    fid = open(filename, 'w')
+    fid.write("{0}\n{1}\n".format(nx, ny))
+
+    for start in range(0, nx * ny, chunk_size):
+        stop = min(start + chunk_size, nx * ny)
+        values = np.column_stack((X[start:stop], Y[start:stop], Q[start:stop]))
+        fid.write((line * (stop - start)) % tuple(values.ravel().tolist()))
+
+    fid.close()
@@ -1,19 +1,38 @@
+import os
 import numpy as np
 
-def write_to_qgis(filename,data,xllcorner,yllcorner,dx,no_data):
-    fid = open(filename,'w')
+def write_to_qgis(filename,data,xllcorner,yllcorner,dx,no_data,
+                  fmt = "%.12g",binary = False):
+    """
+    Write a gridded data set to an Arc/Info ASCII grid file, or if `binary`
+    is True, to an ESRI binary grid, i.e. a .flt file of 32-bit floats
+    together with a .hdr file, using the stem of `filename`.
+    """
     (ny,nx) = np.shape(data)
 
-    fid.write('ncols         {0}\n'.format(nx))
-    fid.write('nrows         {0}\n'.format(ny))
-    fid.write('xllcorner     {0}\n'.format(xllcorner))
-    fid.write('yllcorner     {0}\n'.format(yllcorner))
-    fid.write('cellsize      {0}\n'.format(dx))
-    fid.write('NODATA_value  {0}\n'.format(no_data))
+    header = ('ncols         {0}\n'.format(nx) +
+              'nrows         {0}\n'.format(ny) +
+              'xllcorner     {0}\n'.format(xllcorner) +
+              'yllcorner     {0}\n'.format(yllcorner) +
+              'cellsize      {0}\n'.format(dx) +
+              'NODATA_value  {0}\n'.format(no_data))
 
-    for i in range(ny-1,-1,-1):
-        for j in range(nx):
-            fid.write('{0} '.format(data[i,j]))
-        fid.write('\n')
+    # The first row of the file is the northernmost row of the grid
+    rows = np.asarray(data)[::-1,:]
 
-    fid.close()
+    if binary:
+        stem = os.path.splitext(filename)[0]
+
+        fid = open(stem + '.hdr','w')
+        fid.write(header)
+        fid.write('byteorder     LSBFIRST\n')
+        fid.close()
+
+        fid = open(stem + '.flt','wb')
+        np.asarray(rows,dtype='<f4').tofile(fid)
+        fid.close()
+    else:
+        fid = open(filename,'w')
+        fid.write(header)
+        np.savetxt(fid,rows,fmt=fmt,delimiter=' ')
+        fid.close()
@@ -69,6 +69,8 @@ def main(argv):
                         help = "Output directory and file stem")
     parser.add_argument("-p", "--partitions", required = True,
                         help = "Number of mesh partitions")
+    parser.add_argument("-j", "--jobs", required = False, default = 1,
+                        help = "Number of partitions to read at once")
 
     args, _ = parser.parse_known_args(argv)
 
@@ -76,6 +78,7 @@ def main(argv):
     elmer_dir = args.elmer
     out_file = args.output
     partitions = int(args.partitions)
+    jobs = int(args.jobs)
     surf_file = args.surface
     bed_file  = args.bed
 
@@ -110,25 +113,25 @@ def main(argv):
     tri = Triangulation(xm, ym, ele)
 
     # Get the depth-averaged computed velocities from Elmer
-    um = get_field("velocity 1", elmer_dir, partitions,
-                   tri, surface = "average")
-    vm = get_field("velocity 2", elmer_dir, partitions,
-                   tri, surface = "average")
+    um, vm = get_fields([("velocity 1", "average"),
+                         ("velocity 2", "average")],
+                        elmer_dir, partitions, tri, jobs = jobs)
 
     # Interpolate the depth-averaged velocities to the same grid as the DEMs
-    finder = tri.get_trifinder()
-    interp_u = LinearTriInterpolator(tri, um, finder)
-    interp_v = LinearTriInterpolator(tri, vm, finder)
+    A, inside = grid_interpolation_operator(expanduser(mesh_file), tri, x, y)
+
+    # Leave out the edges of the grid
+    inside = np.copy(inside)
+    inside[0, :] = False
+    inside[-1, :] = False
+    inside[:, 0] = False
+    inside[:, -1] = False
 
     u = -9999.0 * np.ones((ny, nx), dtype = np.float64)
     v = -9999.0 * np.ones((ny, nx), dtype = np.float64)
 
-    for i in range(1, ny-1):
-        for j in range(1, nx-1):
-            k = int(finder(x[j], y[i]))
-            if k != -1:
-                u[i, j] = interp_u(x[j], y[i])
-                v[i, j] = interp_v(x[j], y[i])
+    u[inside] = A.dot(um).reshape((ny, nx))[inside]
+    v[inside] = A.dot(vm).reshape((ny, nx))[inside]
 
     write_to_qgis(out_file + "_vx.txt", u, x[0], y[0], dx, -9999.0)
     write_to_qgis(out_file + "_vy.txt", v, x[0], y[0], dx, -9999.0)
@@ -9,7 +9,7 @@ from os.path import expanduser
 from matplotlib.tri import *
 
 from scripts.meshes import read_triangle_mesh, gridded_to_point_cloud, area
-from scripts.elmer import get_field
+from scripts.elmer import get_fields
 from scripts.read_dem import read_dem
 
 
@@ -111,11 +111,14 @@ def main(argv):
                         help = "Surface DEM file")
     parser.add_argument("-p", "--partitions", required = True,
                         help = "Number of mesh partitions")
+    parser.add_argument("-j", "--jobs", required = False, default = 1,
+                        help = "Number of partitions to read at once")
     args, _ = parser.parse_known_args(argv)
 
     mesh_file = args.mesh
     elmer_dir = args.elmer
     partitions = int(args.partitions)
+    jobs       = int(args.jobs)
     bed_file   = args.bed
     surf_file  = args.surface
 
@@ -126,15 +129,15 @@ def main(argv):
 
     print "Done reading Triangle mesh"
 
-    # Get the basal friction parameter from Elmer
-    beta = get_field("beta", elmer_dir, partitions, tri, surface = "bottom")
-
-    # Get the computed basal and depth-averaged velocities
-    ub = get_field("velocity 1", elmer_dir, partitions, tri, surface = "bottom")
-    vb = get_field("velocity 2", elmer_dir, partitions, tri, surface = "bottom")
-
-    uh = get_field("velocity 1", elmer_dir, partitions, tri, surface = "average")
-    vh = get_field("velocity 2", elmer_dir, partitions, tri, surface = "average")
+    # Get the basal friction parameter and the computed basal and
+    # depth-averaged velocities from Elmer
+    beta, ub, vb, uh, vh = get_fields([("beta",       "bottom"),
+                                       ("velocity 1", "bottom"),
+                                       ("velocity 2", "bottom"),
+                                       ("velocity 1", "average"),
+                                       ("velocity 2", "average")],
+                                      elmer_dir, partitions, tri,
+                                      jobs = jobs)
 
     print "Done getting Elmer output"
 
@@ -148,10 +151,15 @@ def main(argv):
 
     # Compute the driving stress
     xb, yb, bb = read_dem(bed_file)
-    b = gridded_to_point_cloud(xm, ym, xb, yb, bb)
-
     xs, ys, ss = read_dem(surf_file)
-    s = gridded_to_point_cloud(xm, ym, xs, ys, ss)
+
+    # If the bed and surface DEMs are on the same grid, they can share the
+    # interpolation weights
+    if np.array_equal(xb, xs) and np.array_equal(yb, ys):
+        b, s = gridded_to_point_cloud(xm, ym, xb, yb, [bb, ss])
+    else:
+        b = gridded_to_point_cloud(xm, ym, xb, yb, bb)
+        s = gridded_to_point_cloud(xm, ym, xs, ys, ss)
 
     # Compute the stresses
     basal_power   = basal_stress_power(tri, ub, vb, tau_b_x, tau_b_y)